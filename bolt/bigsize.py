@@ -1,7 +1,8 @@
 # Copyright (c) 2020 Jarret Dyrbye
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php
-from bolt.util import h2b, i2b, b2i
+from bolt.util import h2b, i2b
+from bolt.cursor import Cursor
 
 class BigSize:
     """
@@ -9,79 +10,119 @@ class BigSize:
     https://github.com/lightningnetwork/lightning-rfc/blob/master/01-messaging.md#appendix-a-bigsize-test-vectors
     """
     @staticmethod
-    def peek_8(byte_string):
-        if len(byte_string) < 1:
+    def read_8(cursor):
+        val = cursor.read_int(1)
+        if val is None:
             return None, "underrun while peeking a uint8"
-        return b2i(byte_string[0:1]), None
+        return val, None
 
     @staticmethod
-    def peek_16(byte_string):
-        if len(byte_string) < 2:
+    def read_16(cursor):
+        val = cursor.read_int(2)
+        if val is None:
             return None, "underrun while peeking a uint16"
-        val = b2i(byte_string[0:2])
         if val < 0xfd:
             return None, "not a minimally encoded unit16"
         return val, None
 
     @staticmethod
-    def peek_32(byte_string):
-        if len(byte_string) < 4:
+    def read_32(cursor):
+        val = cursor.read_int(4)
+        if val is None:
             return None, "underrun while peeking a uint32"
-        val = b2i(byte_string[0:4])
         if val < 0x10000:
             return None, "not a minimally encoded uint32"
         return val, None
 
     @staticmethod
-    def peek_64(byte_string):
-        if len(byte_string) < 8:
+    def read_64(cursor):
+        val = cursor.read_int(8)
+        if val is None:
             return None, "underrun while peeking a uint64"
-        val = b2i(byte_string[0:8])
         if val < 0x100000000:
             return None, "not a minimally encoded uint64"
         return val, None
 
+    @staticmethod
+    def read(cursor):
+        """ Reads a BigSize at the cursor and moves the cursor past it. The
+            second return value is for passing an error string if there is an
+            error or None otherwise. On error the cursor is left where it
+            was. """
+        start = cursor.offset
+        if start >= len(cursor.view):
+            return None, "underrun while peeking a uint8"
+        head = cursor.view[start]
+        if head < 0xfd:
+            # the common case, skip the calls
+            cursor.offset = start + 1
+            return head, None
+        cursor.offset = start + 1
+        if head == 0xfd:
+            val, err = BigSize.read_16(cursor)
+        elif head == 0xfe:
+            val, err = BigSize.read_32(cursor)
+        else:
+            val, err = BigSize.read_64(cursor)
+        if err:
+            cursor.offset = start
+            return None, err
+        return val, None
+
+    ###########################################################################
+
+    @staticmethod
+    def _peek_with(read_func, byte_string):
+        return read_func(Cursor(byte_string))
+
+    @staticmethod
+    def peek_8(byte_string):
+        return BigSize._peek_with(BigSize.read_8, byte_string)
+
+    @staticmethod
+    def peek_16(byte_string):
+        return BigSize._peek_with(BigSize.read_16, byte_string)
+
+    @staticmethod
+    def peek_32(byte_string):
+        return BigSize._peek_with(BigSize.read_32, byte_string)
+
+    @staticmethod
+    def peek_64(byte_string):
+        return BigSize._peek_with(BigSize.read_64, byte_string)
+
     @staticmethod
     def peek(byte_string):
         """ Peeks a BigSize off the front of the byte string. The second
             return value is for passing an error string if there is an error or
             None otherwise. """
-        head, err = BigSize.peek_8(byte_string)
-        if err:
-            return None, err
-        if head == 0xfd:
-            val, err = BigSize.peek_16(byte_string)
-            return (None, err) if err else (val, None)
-        elif head == 0xfe:
-            val, err = BigSize.peek_32(byte_string)
-            return (None, err) if err else (val, None)
-        elif head == 0xff:
-            val, err = BigSize.peek_64(byte_string)
-            return (None, err) if err else (val, None)
-        else:
-            return head, None
+        return BigSize._peek_with(BigSize.read, byte_string)
 
     ###########################################################################
 
+    @staticmethod
+    def _pop_with(read_func, byte_string):
+        cursor = Cursor(byte_string)
+        val, err = read_func(cursor)
+        if err:
+            return None, None, err
+        return val, byte_string[cursor.offset:], None
+
     @staticmethod
     def pop_8(byte_string):
-        val, err = BigSize.peek_8(byte_string)
-        return (None, None, err) if err else (val, byte_string[1:], None)
+        return BigSize._pop_with(BigSize.read_8, byte_string)
 
     @staticmethod
     def pop_16(byte_string):
-        val, err = BigSize.peek_16(byte_string)
-        return (None, None, err) if err else (val, byte_string[2:], None)
+        return BigSize._pop_with(BigSize.read_16, byte_string)
 
     @staticmethod
     def pop_32(byte_string):
-        val, err = BigSize.peek_32(byte_string)
-        return (None, None, err) if err else (val, byte_string[4:], None)
+        return BigSize._pop_with(BigSize.read_32, byte_string)
 
     @staticmethod
     def pop_64(byte_string):
-        val, err = BigSize.peek_64(byte_string)
-        return (None, None, err) if err else (val, byte_string[8:], None)
+        return BigSize._pop_with(BigSize.read_64, byte_string)
 
     @staticmethod
     def pop(byte_string):
@@ -89,23 +130,22 @@ class BigSize:
             decoded value and the remaining byte string. The third return
             value is for passing an error string if there is an error or None
             otherwise. """
-        head, byte_string, err = BigSize.pop_8(byte_string)
-        if err:
-            return None, None, err
-        if head == 0xfd:
-            val, byte_string, err = BigSize.pop_16(byte_string)
-            return (None, None, err) if err else (val, byte_string, None)
-        elif head == 0xfe:
-            val, byte_string, err = BigSize.pop_32(byte_string)
-            return (None, None, err) if err else (val, byte_string, None)
-        elif head == 0xff:
-            val, byte_string, err = BigSize.pop_64(byte_string)
-            return (None, None, err) if err else (val, byte_string, None)
-        else:
-            return head, byte_string, None
+        return BigSize._pop_with(BigSize.read, byte_string)
 
     ###########################################################################
 
+    @staticmethod
+    def encoded_len(val):
+        assert val <= 0xffffffffffffffff, "cannot encode bigger than uint64"
+        if val < 0xfd:
+            return 1
+        if val < 0x10000:
+            return 3
+        if val < 0x100000000:
+            return 5
+        else:
+            return 9
+
     @staticmethod
     def encode(val):
         assert val <= 0xffffffffffffffff, "cannot encode bigger than uint64"
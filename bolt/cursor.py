@@ -0,0 +1,50 @@
+# Copyright (c) 2020 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+from bolt.util import b2i
+
+class Cursor:
+    """
+    A read position into a byte string. Reads hand back memoryview slices of
+    the underlying buffer and move the offset forward, so walking a stream of
+    fields doesn't copy the remainder for every field the way slicing the
+    front off a bytes object does.
+    """
+    def __init__(self, byte_string, offset=0):
+        self.view = memoryview(byte_string)
+        self.offset = offset
+
+    def remaining(self):
+        return len(self.view) - self.offset
+
+    def at_end(self):
+        return self.offset >= len(self.view)
+
+    ###########################################################################
+
+    def peek(self, n_bytes):
+        """ returns a memoryview of the next n_bytes without consuming them,
+            or None if there are not that many left. """
+        end = self.offset + n_bytes
+        if end > len(self.view):
+            return None
+        return self.view[self.offset:end]
+
+    def read(self, n_bytes):
+        """ returns a memoryview of the next n_bytes and consumes them, or
+            None if there are not that many left. """
+        end = self.offset + n_bytes
+        if end > len(self.view):
+            return None
+        view = self.view[self.offset:end]
+        self.offset = end
+        return view
+
+    def read_int(self, n_bytes):
+        """ consumes n_bytes as a big endian unsigned integer, or returns None
+            if there are not that many left. """
+        view = self.read(n_bytes)
+        return None if view is None else b2i(view)
+
+    def rest(self):
+        return self.view[self.offset:]
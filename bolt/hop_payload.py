@@ -22,6 +22,12 @@ class LegacyHopPayload:
         return (encoded_version + encoded_scid + encoded_amt +
                 encoded_outgoing + padding)
 
+    @staticmethod
+    def encoded_len():
+        # version, short_channel_id, amt_to_forward, outgoing_cltv_value and
+        # padding are all fixed size
+        return 1 + 8 + 8 + 4 + 12
+
     @staticmethod
     def parse(byte_string):
         scid, remainder, err = Namespace.pop_short_channel_id(byte_string)
@@ -146,6 +152,40 @@ class TlvHopPayload:
                                                          total_msat)
         return BigSize.encode(len(payload)) + payload
 
+    ###########################################################################
+
+    # The *_len() functions give the length of what the matching encode_*()
+    # function would produce without encoding it, for sizing an onion before
+    # building it. extra_len is the encoded length of any further TLVs
+    # appended to the payload content.
+
+    @staticmethod
+    def _amt_and_cltv_len(amt_to_forward, outgoing_cltv_value):
+        amt_len = Namespace.minimal_tu_bytes(amt_to_forward)
+        cltv_len = Namespace.minimal_tu_bytes(outgoing_cltv_value)
+        return Tlv.encoded_len(2, amt_len) + Tlv.encoded_len(4, cltv_len)
+
+    @staticmethod
+    def non_final_len(amt_to_forward, outgoing_cltv_value, extra_len=0):
+        content_len = (TlvHopPayload._amt_and_cltv_len(amt_to_forward,
+                                                       outgoing_cltv_value) +
+                       Tlv.encoded_len(6, 8) + extra_len)
+        return BigSize.encoded_len(content_len) + content_len
+
+    @staticmethod
+    def final_len(amt_to_forward, outgoing_cltv_value, payment_secret=None,
+                  total_msat=None, extra_len=0):
+        content_len = (TlvHopPayload._amt_and_cltv_len(amt_to_forward,
+                                                       outgoing_cltv_value) +
+                       extra_len)
+        if payment_secret:
+            assert total_msat != None, "payment_secret without total_msat"
+            content_len += Tlv.encoded_len(
+                8, 32 + Namespace.minimal_tu_bytes(total_msat))
+        return BigSize.encoded_len(content_len) + content_len
+
+    ###########################################################################
+
     @staticmethod
     def encode_custom_test(amt_to_forward=None, outgoing_cltv_value=None,
                            short_channel_id=None, payment_data=None):
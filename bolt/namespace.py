@@ -3,6 +3,7 @@
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php
 from bolt.util import b2i, b2h, h2i, h2b, i2h, i2b
 from bolt.tlv import Tlv
+from bolt.cursor import Cursor
 
 class Namespace:
     """
@@ -10,14 +11,31 @@ class Namespace:
     provides generic pop helpers for the fundamental types defined here:
     https://github.com/lightningnetwork/lightning-rfc/blob/master/01-messaging.md#fundamental-types
     """
+    @staticmethod
+    def _pop_with(read_func, byte_string, *args):
+        # the pop_*() helpers are the read_*() helpers run over a throwaway
+        # cursor, handing back the remainder as the same type that came in
+        cursor = Cursor(byte_string)
+        val, err = read_func(*args, cursor)
+        if err:
+            return None, None, err
+        return val, byte_string[cursor.offset:], None
+
+    ###########################################################################
+
+    @staticmethod
+    def read_tlv(cursor):
+        return Tlv.read(cursor)
+
     @staticmethod
     def pop_tlv(byte_string):
         return Tlv.pop(byte_string)
 
     @staticmethod
     def tlvs_are_valid(byte_string):
-        while len(byte_string) > 0:
-            _, byte_string, err = Namespace.pop_tlv(byte_string)
+        cursor = Cursor(byte_string)
+        while not cursor.at_end():
+            _, err = Tlv.read(cursor)
             if err:
                 return False
         return True
@@ -25,8 +43,9 @@ class Namespace:
     @staticmethod
     def iter_tlvs(byte_string):
         assert Namespace.tlvs_are_valid(byte_string), "bad byte_string?"
-        while len(byte_string) > 0:
-            tlv, byte_string, _ = Tlv.pop(byte_string)
+        cursor = Cursor(byte_string)
+        while not cursor.at_end():
+            tlv, _ = Tlv.read(cursor)
             yield tlv
 
     ###########################################################################
@@ -35,37 +54,62 @@ class Namespace:
     def encode_bytes(hex_string):
         return h2b(hex_string)
 
+    @staticmethod
+    def read_bytes(n_bytes, cursor):
+        view = cursor.read(n_bytes)
+        if view is None:
+            return None, "underrun while popping bytes"
+        return b2h(view), None
+
     @staticmethod
     def pop_bytes(n_bytes, byte_string):
-        if len(byte_string) < n_bytes:
-            return None, None, "underrun while popping bytes"
-        return b2h(byte_string[:n_bytes]), byte_string[n_bytes:], None
+        return Namespace._pop_with(Namespace.read_bytes, byte_string, n_bytes)
 
     ###########################################################################
 
+    @staticmethod
+    def read_u8(cursor):
+        val = cursor.read_int(1)
+        if val is None:
+            return None, "underrun while popping a u8"
+        return val, None
+
+    @staticmethod
+    def read_u16(cursor):
+        val = cursor.read_int(2)
+        if val is None:
+            return None, "underrun while popping a u16"
+        return val, None
+
+    @staticmethod
+    def read_u32(cursor):
+        val = cursor.read_int(4)
+        if val is None:
+            return None, "underrun while popping a u32"
+        return val, None
+
+    @staticmethod
+    def read_u64(cursor):
+        val = cursor.read_int(8)
+        if val is None:
+            return None, "underrun while popping a u64"
+        return val, None
+
     @staticmethod
     def pop_u8(byte_string):
-        if len(byte_string) < 1:
-            return None, None, "underrun while popping a u8"
-        return b2i(byte_string[:1]), byte_string[1:], None
+        return Namespace._pop_with(Namespace.read_u8, byte_string)
 
     @staticmethod
     def pop_u16(byte_string):
-        if len(byte_string) < 2:
-            return None, None, "underrun while popping a u16"
-        return b2i(byte_string[:2]), byte_string[2:], None
+        return Namespace._pop_with(Namespace.read_u16, byte_string)
 
     @staticmethod
     def pop_u32(byte_string):
-        if len(byte_string) < 4:
-            return None, None, "underrun while popping a u32"
-        return b2i(byte_string[:4]), byte_string[4:], None
+        return Namespace._pop_with(Namespace.read_u32, byte_string)
 
     @staticmethod
     def pop_u64(byte_string):
-        if len(byte_string) < 8:
-            return None, None, "underrun while popping a u64"
-        return b2i(byte_string[:8]), byte_string[8:], None
+        return Namespace._pop_with(Namespace.read_u64, byte_string)
 
     ###########################################################################
 
@@ -109,43 +153,44 @@ class Namespace:
             return 8
 
     @staticmethod
-    def pop_tu16(n_bytes, byte_string):
-        if n_bytes > 2:
-            return None, None, "cannot pop more than 2 bytes for a tu16"
-        if len(byte_string) < n_bytes:
-            return None, None, "underrun while popping tu16"
+    def _read_tu(n_bytes, max_bytes, name, cursor):
+        if n_bytes > max_bytes:
+            return None, "cannot pop more than %d bytes for a %s" % (max_bytes,
+                                                                     name)
         if n_bytes == 0:
-            return 0, byte_string, None
-        val = b2i(byte_string[:n_bytes])
+            return 0, None
+        start = cursor.offset
+        val = cursor.read_int(n_bytes)
+        if val is None:
+            return None, "underrun while popping %s" % name
         if n_bytes != Namespace.minimal_tu_bytes(val):
-            return None, None, "not minimal encoding for value"
-        return val, byte_string[n_bytes:], None
+            cursor.offset = start
+            return None, "not minimal encoding for value"
+        return val, None
+
+    @staticmethod
+    def read_tu16(n_bytes, cursor):
+        return Namespace._read_tu(n_bytes, 2, "tu16", cursor)
+
+    @staticmethod
+    def read_tu32(n_bytes, cursor):
+        return Namespace._read_tu(n_bytes, 4, "tu32", cursor)
+
+    @staticmethod
+    def read_tu64(n_bytes, cursor):
+        return Namespace._read_tu(n_bytes, 8, "tu64", cursor)
+
+    @staticmethod
+    def pop_tu16(n_bytes, byte_string):
+        return Namespace._pop_with(Namespace.read_tu16, byte_string, n_bytes)
 
     @staticmethod
     def pop_tu32(n_bytes, byte_string):
-        if n_bytes > 4:
-            return None, None, "cannot pop more than 4 bytes for a tu32"
-        if len(byte_string) < n_bytes:
-            return None, None, "underrun while popping tu32"
-        if n_bytes == 0:
-            return 0, byte_string, None
-        val = b2i(byte_string[:n_bytes])
-        if n_bytes != Namespace.minimal_tu_bytes(val):
-            return None, None, "not minimal encoding for value"
-        return val, byte_string[n_bytes:], None
+        return Namespace._pop_with(Namespace.read_tu32, byte_string, n_bytes)
 
     @staticmethod
     def pop_tu64(n_bytes, byte_string):
-        if n_bytes > 8:
-            return None, None, "cannot pop more than 8 bytes for a tu64"
-        if len(byte_string) < n_bytes:
-            return None, None, "underrun while popping tu62"
-        if n_bytes == 0:
-            return 0, byte_string, None
-        val = b2i(byte_string[:n_bytes])
-        if n_bytes != Namespace.minimal_tu_bytes(val):
-            return None, None, "not minimal encoding for value"
-        return val, byte_string[n_bytes:], None
+        return Namespace._pop_with(Namespace.read_tu64, byte_string, n_bytes)
 
     ###########################################################################
 
@@ -173,48 +218,79 @@ class Namespace:
 
     ###########################################################################
 
+    @staticmethod
+    def read_chain_hash(cursor):
+        view = cursor.read(32)
+        if view is None:
+            return None, "underrun while popping chain_hash"
+        return b2h(view), None
+
+    @staticmethod
+    def read_channel_id(cursor):
+        view = cursor.read(32)
+        if view is None:
+            return None, "underrun while popping channel_id"
+        return b2h(view), None
+
+    @staticmethod
+    def read_sha256(cursor):
+        view = cursor.read(32)
+        if view is None:
+            return None, "underrun while popping sha256"
+        return b2h(view), None
+
+    @staticmethod
+    def read_signature(cursor):
+        view = cursor.read(64)
+        if view is None:
+            return None, "underrun while popping signature"
+        return b2h(view), None
+
+    @staticmethod
+    def read_point(cursor):
+        view = cursor.peek(33)
+        if view is None:
+            return None, "underrun wihle popping point"
+        if view[0] not in (0x02, 0x03):
+            return None, "not valid compressed point"
+        cursor.read(33)
+        return b2h(view), None
+
+    @staticmethod
+    def read_short_channel_id(cursor):
+        view = cursor.read(8)
+        if view is None:
+            return None, "underrun while popping short_channel_id"
+        block_height = b2i(view[:3])
+        tx_index = b2i(view[3:6])
+        output_index = b2i(view[6:8])
+        formatted = "%dx%dx%d" % (block_height, tx_index, output_index)
+        return formatted, None
+
     @staticmethod
     def pop_chain_hash(byte_string):
-        if not len(byte_string) >= 32:
-            return None, None, "underrun while popping chain_hash"
-        return b2h(byte_string)[:32], byte_string[32:], None
+        return Namespace._pop_with(Namespace.read_chain_hash, byte_string)
 
     @staticmethod
     def pop_channel_id(byte_string):
-        if not len(byte_string) >= 32:
-            return None, None, "underrun while popping channel_id"
-        return b2h(byte_string[:32]), byte_string[32:], None
+        return Namespace._pop_with(Namespace.read_channel_id, byte_string)
 
     @staticmethod
     def pop_sha256(byte_string):
-        if not len(byte_string) >= 64:
-            return None, None, "underrun while popping signature"
-        return b2h(byte_string[:64]), byte_string[64:], None
+        return Namespace._pop_with(Namespace.read_sha256, byte_string)
 
     @staticmethod
     def pop_signature(byte_string):
-        if not len(byte_string) >= 64:
-            return None, None, "underrun while popping signature"
-        return b2h(byte_string[:64]), byte_string[64:], None
+        return Namespace._pop_with(Namespace.read_signature, byte_string)
 
     @staticmethod
     def pop_point(byte_string):
-        if not len(byte_string) >= 33:
-            return None, None, "underrun wihle popping point"
-        point = b2h(byte_string[:33])
-        if not point.startswith("02") and not point.startswith("03"):
-            return None, None, "not valid compressed point"
-        return point, byte_string[33:], None
+        return Namespace._pop_with(Namespace.read_point, byte_string)
 
     @staticmethod
     def pop_short_channel_id(byte_string):
-        if not len(byte_string) >= 8:
-            return None, None, "underrun while popping short_channel_id"
-        block_height = b2i(byte_string[:3])
-        tx_index = b2i(byte_string[3:6])
-        output_index = b2i(byte_string[6:8])
-        formatted = "%dx%dx%d" % (block_height, tx_index, output_index)
-        return formatted, byte_string[8:], None
+        return Namespace._pop_with(Namespace.read_short_channel_id,
+                                   byte_string)
 
     ###########################################################################
 
@@ -262,48 +338,48 @@ class Namespace:
             parsed_tlvs[tlv.t] = parsed_tlv
         return parsed_tlvs, None
 
-    @staticmethod
-    def _has_unknown_even_types(tlvs, tlv_parsers):
-        present = set(tlv.t for tlv in tlvs)
-        known = set(tlv_parsers.keys())
-        unknown = present.difference(known)
-        for t in list(unknown):
-            if t % 2 == 0:
-                return True
-        return False
-
-    @staticmethod
-    def _ordered_ascending(tlvs):
-        if len(tlvs) == 0:
-            return True
-        if len(tlvs) == 1:
-            return True
-        max_type = tlvs[0].t
-        for tlv in tlvs[1:]:
-            if tlv.t <= max_type:
-                return False
-            max_type = tlv.t
-        return True
-
-    @staticmethod
-    def _has_duplicates(tlvs):
-        types = [tlv.t for tlv in tlvs]
-        dedupe = set(tlv.t for tlv in tlvs)
-        return len(types) != len(dedupe)
+    # Errors are ranked the way the separate whole-stream checks used to be
+    # run one after another, so the single pass reports the same one.
+    ERR_UNKNOWN_EVEN = (0, "got unknown even type tlv for Namespace")
+    ERR_DUPLICATE = (1, "duplicate TLVs in stream")
+    ERR_NOT_ASCENDING = (2, "tlvs values not ascending")
+    RANK_PARSER = 3
 
     @staticmethod
     def parse(byte_string, tlv_parsers):
-        if not Namespace.tlvs_are_valid(byte_string):
-            return None, "tlvs are not valid"
-        tlvs = list(Namespace.iter_tlvs(byte_string))
-        if Namespace._has_unknown_even_types(tlvs, tlv_parsers):
-            return None, "got unknown even type tlv for Namespace"
-        if Namespace._has_duplicates(tlvs):
-            return None, "duplicate TLVs in stream"
-        if not Namespace._ordered_ascending(tlvs):
-            return None, "tlvs values not ascending"
-        parsed_tlvs, err = Namespace.parse_tlvs(tlvs, tlv_parsers)
-        if err:
-            return None, err
+        """ Walks the stream once, checking framing, unknown even types,
+            duplicates and ordering while dispatching each tlv to its parser.
+            A malformed stream is reported over everything else, so the walk
+            continues to the end after any other error, but the parsers stop
+            being called. """
+        cursor = Cursor(byte_string)
+        parsed_tlvs = {}
+        seen = set()
+        prev_t = None
+        found = None
+        while not cursor.at_end():
+            tlv, err = Tlv.read(cursor)
+            if err:
+                return None, "tlvs are not valid"
+            t = tlv.t
+            if found is Namespace.ERR_UNKNOWN_EVEN:
+                continue
+            if t % 2 == 0 and t not in tlv_parsers:
+                found = Namespace.ERR_UNKNOWN_EVEN
+            elif t in seen:
+                if found is None or found[0] > Namespace.ERR_DUPLICATE[0]:
+                    found = Namespace.ERR_DUPLICATE
+            elif prev_t is not None and t <= prev_t:
+                if found is None or found[0] > Namespace.ERR_NOT_ASCENDING[0]:
+                    found = Namespace.ERR_NOT_ASCENDING
+            elif found is None:
+                parsed_tlv, err = Namespace.parse_tlv(tlv, tlv_parsers)
+                if err:
+                    found = (Namespace.RANK_PARSER, err)
+                else:
+                    parsed_tlvs[t] = parsed_tlv
+            seen.add(t)
+            prev_t = t
+        if found:
+            return None, found[1]
         return parsed_tlvs, None
-
@@ -3,6 +3,7 @@
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php
 from bolt.util import b2h
 from bolt.bigsize import BigSize
+from bolt.cursor import Cursor
 
 class Tlv:
     """
@@ -21,30 +22,42 @@ class Tlv:
     ###########################################################################
 
     @staticmethod
-    def peek(byte_string):
-        t, remainder, err = BigSize.pop(byte_string)
+    def read(cursor):
+        """ Reads a TLV at the cursor and moves the cursor past it. Only the
+            value bytes are copied out of the underlying buffer. On error the
+            cursor is left where it was. """
+        start = cursor.offset
+        t, err = BigSize.read(cursor)
         if err:
             return None, "could not get type: %s" % err
-        l, remainder, err = BigSize.pop(remainder)
+        l, err = BigSize.read(cursor)
         if err:
+            cursor.offset = start
             return None, "could not get length: %s" % err
-        if len(remainder) < l:
+        v = cursor.read(l)
+        if v is None:
+            cursor.offset = start
             return None, "value truncated"
-        return Tlv(t, remainder[:l]), None
+        return Tlv(t, bytes(v)), None
+
+    @staticmethod
+    def peek(byte_string):
+        return Tlv.read(Cursor(byte_string))
 
     @staticmethod
     def pop(byte_string):
-        t, byte_string, err = BigSize.pop(byte_string)
+        cursor = Cursor(byte_string)
+        tlv, err = Tlv.read(cursor)
         if err:
-            return None, None, "could not get type: %s" % err
-        l, byte_string, err = BigSize.pop(byte_string)
-        if err:
-            return None, None, "could not get length: %s" % err
-        if len(byte_string) < l:
-            return None, None, "value truncated"
-        return Tlv(t, byte_string[:l]), byte_string[l:], None
+            return None, None, err
+        return tlv, byte_string[cursor.offset:], None
 
     ###########################################################################
 
+    @staticmethod
+    def encoded_len(t, l):
+        """ length of the encoding of a TLV of type t with an l byte value """
+        return BigSize.encoded_len(t) + BigSize.encoded_len(l) + l
+
     def encode(self):
         return BigSize.encode(self.t) + BigSize.encode(self.l) + self.v
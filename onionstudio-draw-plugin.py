@@ -8,7 +8,8 @@ from pyln.client import Plugin
 from onionstudio.pixel import Pixel
 from onionstudio.manual import ManualToPixels
 from onionstudio.png import PngToPixels
-from onionstudio.draw import Draw
+from onionstudio.draw import Draw, DEFAULT_IN_FLIGHT
+from onionstudio.canvas import Canvas
 
 # the "offical" onion studio node
 NODE = "02e389d861acd9d6f5700c99c6c33dd4460d6f1e2f6ba89d1f4f36be85fc60f8d7"
@@ -42,6 +43,12 @@ pixels - is a string that specifies the x,y cordinates and RGB colors.
 
         1_1_0f0_2_2_0f0 will set the pixels at coordinates
         (1, 1) and (2,2) to green #0f0
+
+canvas - optional path to a copy of the canvas, either a studio.dat file or
+    a saved gzip snapshot from the server. Pixels that already have their
+    color on it are not drawn.
+
+in_flight - optional number of onions to have pending at once.
 """
 
 def parse_pixel_args(pixels_string):
@@ -51,15 +58,31 @@ def parse_pixel_args(pixels_string):
         return None, err
     return pixels, None
 
+def diff_canvas(plugin, canvas_filename, pixels):
+    if not canvas_filename:
+        return pixels, None
+    canvas, err = Canvas.load(os.path.abspath(canvas_filename))
+    if err:
+        return None, err
+    changed = canvas.diff(pixels)
+    plugin.log("skipping %d of %d pixels already matching the canvas" % (
+               len(pixels) - len(changed), len(pixels)))
+    if len(changed) == 0:
+        return None, "nothing to draw, the canvas already matches"
+    return changed, None
+
 @plugin.method("os_draw_manual", category=CATEGORY, desc=MANUAL_DESC,
                long_desc=MANUAL_LONG_DESC)
-def draw_manual(plugin, pixels):
+def draw_manual(plugin, pixels, canvas="", in_flight=DEFAULT_IN_FLIGHT):
     pixels, err = parse_pixel_args(pixels)
+    if err:
+        return err
+    pixels, err = diff_canvas(plugin, canvas, pixels)
     if err:
         return err
     plugin.log("pixels: %s" % [str(p) for p in pixels])
     node = plugin.get_option("onion_studio_node")
-    d = Draw(plugin.rpc, node, pixels)
+    d = Draw(plugin.rpc, node, pixels, in_flight=int(in_flight))
     report, err = d.run()
     if report:
         report = "drew %d out of %d pixels" % (report['pixels_drawn'],
@@ -91,6 +114,12 @@ requires. Transparent pixels in the image will not be drawn.
     resume_at_px = a pixel number in the list of pixels to resume a drawing
         operation. Allows easy continuation if a previous mult-part drawing
         operation fails midway.
+
+    canvas = optional path to a copy of the canvas, either a studio.dat file
+        or a saved gzip snapshot from the server. Pixels that already have
+        their color on it are not drawn.
+
+    in_flight = optional number of onions to have pending at once.
 """
 
 def parse_png_args(x_offset_string, y_offset_string, png_filename):
@@ -108,14 +137,18 @@ def parse_png_args(x_offset_string, y_offset_string, png_filename):
 
 @plugin.method("os_draw_png", category=CATEGORY, desc=PNG_DESC,
                long_desc=PNG_LONG_DESC)
-def draw_png(plugin, x_offset, y_offset, png_filename, big="", resume_at_px=0):
+def draw_png(plugin, x_offset, y_offset, png_filename, big="", resume_at_px=0,
+             canvas="", in_flight=DEFAULT_IN_FLIGHT):
     x_offset, y_offset, png_filename, err = parse_png_args(x_offset, y_offset,
                                                            png_filename)
     if err:
         return err
 
     pp = PngToPixels(png_filename)
-    pixels = list(pp.iter_at_offset(x_offset, y_offset))[resume_at_px:]
+    pixels = pp.batch_at_offset(x_offset, y_offset)[resume_at_px:]
+    pixels, err = diff_canvas(plugin, canvas, pixels)
+    if err:
+        return err
 
     if big != "big" and len(pixels) > PNG_PIXEL_SAFETY:
         return ("*** This will draw %d pixels at a cost of %d satoshis, "
@@ -124,13 +157,16 @@ def draw_png(plugin, x_offset, y_offset, png_filename, big="", resume_at_px=0):
                 "word 'big' at the end of the command") % (len(pixels),
                                                            len(pixels))
     node = plugin.get_option("onion_studio_node")
-    d = Draw(plugin.rpc, node, pixels)
+    d = Draw(plugin.rpc, node, pixels, in_flight=int(in_flight))
     report, err = d.run()
     if report:
         report_str = "drew %d out of %d pixels" % (report['pixels_drawn'],
                                                    report['total_pixels'])
-        if report['pixels_drawn'] != report['total_pixels']:
-            resume_from = report['pixels_drawn'] + resume_at_px
+        if report['pixels_drawn'] != report['total_pixels'] and canvas:
+            report_str += ("\nto attempt to finish this drawing, call again "
+                           "with a fresh copy of the canvas")
+        elif report['pixels_drawn'] != report['total_pixels']:
+            resume_from = report['first_undrawn'] + resume_at_px
             report_str += ("\nto attempt to resume this drawing where it left "
                            "off, call again with '%d' at the end of the "
                            "command as the 'resume_at_px' parameter" %
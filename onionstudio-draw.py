@@ -6,9 +6,10 @@ import os
 import sys
 import argparse
 
-from onionstudio.draw import Draw
+from onionstudio.draw import Draw, DEFAULT_IN_FLIGHT
 from onionstudio.png import PngToPixels
 from onionstudio.manual import ManualToPixels
+from onionstudio.canvas import Canvas
 
 from pyln.client import LightningRpc
 
@@ -17,14 +18,37 @@ NODE = "02e389d861acd9d6f5700c99c6c33dd4460d6f1e2f6ba89d1f4f36be85fc60f8d7"
 
 PNG_PIXEL_SAFETY = 1000
 
+CANVAS_HELP = ("a copy of the canvas, either a studio.dat file or a saved "
+               "gzip snapshot from the server. pixels that already have "
+               "their color on it are not drawn")
+
+IN_FLIGHT_HELP = ("the number of onions to have pending at once (default: "
+                  "%d)" % DEFAULT_IN_FLIGHT)
+
 ###############################################################################
 
+def diff_canvas(s, pixels):
+    if not s.canvas:
+        return pixels, None
+    canvas, err = Canvas.load(s.canvas)
+    if err:
+        return None, err
+    changed = canvas.diff(pixels)
+    print("skipping %d of %d pixels already matching the canvas" % (
+          len(pixels) - len(changed), len(pixels)))
+    return changed, None
+
 def manual_func(s, rpc):
     ap = ManualToPixels(s.pixels)
     pixels, err = ap.parse_pixels()
     if err:
         return None, err
-    d = Draw(rpc, NODE, pixels)
+    pixels, err = diff_canvas(s, pixels)
+    if err:
+        return None, err
+    if len(pixels) == 0:
+        return None, "nothing to draw, the canvas already matches"
+    d = Draw(rpc, NODE, pixels, in_flight=s.in_flight)
     report, err = d.run()
     return report, err
 
@@ -40,7 +64,12 @@ def png_func(s, rpc):
         return None, "no such file? %s" % s.png_file
 
     pp = PngToPixels(s.png_file)
-    pixels = list(pp.iter_at_offset(s.x_offset, s.y_offset))[s.resume_at_px:]
+    pixels = pp.batch_at_offset(s.x_offset, s.y_offset)[s.resume_at_px:]
+    pixels, err = diff_canvas(s, pixels)
+    if err:
+        return None, err
+    if len(pixels) == 0:
+        return None, "nothing to draw, the canvas already matches"
     if not s.big and len(pixels) > PNG_PIXEL_SAFETY:
         return None, ("*** This will draw %d pixels at a cost of %d satoshis, "
                       "which is a lot so we want to make sure you actually intend "
@@ -48,7 +77,7 @@ def png_func(s, rpc):
                       "--big cli option.") % (len(pixels), len(pixels))
 
     #pixels = pixels[0 - (2 * len(pixels) // 3):] # hack to continue failed drawing
-    d = Draw(rpc, NODE, pixels)
+    d = Draw(rpc, NODE, pixels, in_flight=s.in_flight)
     report, err = d.run()
     return report, err
 
@@ -73,6 +102,9 @@ manual.add_argument('pixels', type=str,
                          "pixels to draw separated by underscores. "
                          "Eg. 1_1_fff_2_2_0f0 will set pixel "
                          "(1,1) white (#fff) and (2,2) green (#0f0)")
+manual.add_argument("-c", "--canvas", type=str, help=CANVAS_HELP)
+manual.add_argument("-i", "--in-flight", type=int, default=DEFAULT_IN_FLIGHT,
+                    help=IN_FLIGHT_HELP)
 manual.set_defaults(func=manual_func)
 
 png.add_argument("x_offset", type=int,
@@ -85,6 +117,9 @@ png.add_argument("-b", "--big", action="store_true",
 png.add_argument("-r", "--resume-at-px", type=int, default=0,
                  help="resume the drawing at a this pixels. useful if a draw "
                       "is interrupted midway")
+png.add_argument("-c", "--canvas", type=str, help=CANVAS_HELP)
+png.add_argument("-i", "--in-flight", type=int, default=DEFAULT_IN_FLIGHT,
+                 help=IN_FLIGHT_HELP)
 png.set_defaults(func=png_func)
 
 settings = parser.parse_args()
@@ -101,8 +136,11 @@ report, err = settings.func(settings, rpc)
 if report:
     print("drew %d out of %d pixels" % (report['pixels_drawn'],
                                         report['total_pixels']))
-    if report['pixels_drawn'] != report['total_pixels']:
-        resume_from = settings.resume_at_px + report['pixels_drawn']
+    if report['pixels_drawn'] != report['total_pixels'] and settings.canvas:
+        print("To attempt to finish the draw, call again with a fresh copy "
+              "of the canvas.")
+    elif report['pixels_drawn'] != report['total_pixels']:
+        resume_from = settings.resume_at_px + report['first_undrawn']
         print("To attempt to resume the draw from wher it failed, call again "
               "with  '--resume-at-px %d' at the end." % resume_from)
 if err:
@@ -2,6 +2,7 @@
 # Copyright (c) 2020 Jarret Dyrbye
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php
+import os
 import time
 import sys
 import json
@@ -20,37 +21,243 @@ from txzmq import ZmqSubConnection
 from bolt.util import h2b
 
 from onionstudio.art_db import ArtDb
-from onionstudio.compressor import compressor
+from onionstudio.update_log import DEFAULT_SYNC_RECORDS, DEFAULT_SYNC_MS
+from onionstudio.snapshot import Snapshot
+from onionstudio.frame import DeltaFrame
+from onionstudio.coalesce import Coalescer
+from onionstudio.history import History, DEFAULT_HISTORY_BATCHES
+from onionstudio.subscriptions import Subscriptions, N_SUB_TILES
+from onionstudio.pending import PendingHtlcs, PendingStore, EarlySettlements
+from onionstudio.backpressure import Backpressure
 from onionstudio.extension import Extension, PIXEL_TLV_TYPE
+from onionstudio.pixel import Pixel, PIXEL_BYTE_SIZE
 
 
-UNPAID_PRUNE_CHECK = 60
+UNPAID_PRUNE_CHECK = 10
 UNPAID_PRUNE_SECONDS = 120
 
+# forward_event and htlc_accepted come in over separate subscriptions, so a
+# settlement can arrive first and is held for a while waiting on its htlc
+EARLY_SETTLEMENT_SECONDS = 60
+EARLY_SETTLEMENT_MAX = 10000
+
+# the least a forward that paid for pixels can have kept as its fee
+MIN_PIXEL_FEE_MSAT = 1000
+
+CHECKPOINT_SECONDS = 30
+
+COALESCE_MS = 75
+
+HIGH_WATER_BYTES = 2**16
+SLOW_CLIENT_SECONDS = 30
+SLOW_CLIENT_CHECK = 5
+
+METRICS_SECONDS = 60
+
 ###############################################################################
 
 class AppClient(WebSocketServerProtocol):
     def onConnect(self, request):
         print("Client connecting: {0}".format(request.peer))
+        # a reconnecting client can pass the last seq it applied as
+        # ?resume=<seq> to be sent only what it missed
+        self.resume_seq = None
+        if 'resume' in request.params:
+            try:
+                self.resume_seq = int(request.params['resume'][0])
+            except ValueError:
+                print("could not parse resume seq")
 
     def onOpen(self):
         print("WebSocket client connection open.")
+        # updates that arrive before the snapshot is sent are held back and
+        # only the ones newer than the snapshot are passed on afterwards
+        self.synced_seq = None
+        self.held = []
+        # Twisted pauses us as a producer once more than high_water_bytes are
+        # buffered for the socket, on top of the size of the snapshot once one
+        # is sent. Updates are then skipped rather than buffered and the
+        # client is caught up once the buffer drains.
+        self.pressure = Backpressure(self.server.slow_client_seconds)
+        self.behind = False
+        self.skipped_updates = 0
+        # bytes written since the snapshot, None once it has left the buffer
+        self.after_snapshot = None
+        self.transport.bufferSize = self.server.high_water_bytes
+        self.registerProducer(self, True)
         self.server.clients.append(self)
-        art_bin = self.server.app.art_db.to_bin()
-        compressed_bin = compressor(art_bin)
-        print("compressed art bin len: %d" % len(compressed_bin))
+        self.server.subscriptions.subscribe(self)
+        self.catch_up(self.resume_seq)
+
+    def pauseProducing(self):
+        # called again on every write while past the mark, only the first
+        # one starts the clock
+        if not self.pressure.is_paused():
+            print("client %s is past the high-water mark" % self.peer)
+        self.pressure.paused()
+
+    def resumeProducing(self):
+        self.pressure.resumed()
+        self.check_snapshot_sent()
+        if self.behind:
+            print("client %s drained, catching up after skipping %d updates" %
+                  (self.peer, self.skipped_updates))
+            self.behind = False
+            self.skipped_updates = 0
+            self.catch_up(self.synced_seq)
+
+    def stopProducing(self):
+        pass
+
+    def backlog_bytes(self):
+        # What has been written to the transport but not yet to the socket.
+        # Twisted has no public call for this so it is read from the
+        # FileDescriptor buffer, where the bytes before offset have already
+        # been sent. None for a transport that buffers some other way.
+        t = self.transport
+        try:
+            return len(t.dataBuffer) - t.offset + t._tempDataLen
+        except AttributeError:
+            return None
+
+    def snapshot_in_flight(self):
+        # the buffer holds more than what was written after the snapshot, so
+        # part of the snapshot is still in it
+        if self.after_snapshot is None:
+            return False
+        backlog = self.backlog_bytes()
+        return backlog is not None and backlog > self.after_snapshot
+
+    def check_snapshot_sent(self):
+        # the raised high-water mark is only for the snapshot itself
+        if self.after_snapshot is None or self.snapshot_in_flight():
+            return
+        self.after_snapshot = None
+        self.transport.bufferSize = self.server.high_water_bytes
+
+    def catch_up(self, seq):
+        history = self.server.app.history
+        pixels_bin = None if seq is None else history.since(seq)
+        if pixels_bin is None or self.server.json_updates:
+            self.synced_seq = None
+            self.server.app.snapshot.get(self.send_snapshot)
+            return
+        print("resuming client from seq %d to %d with %d bytes" % (
+              seq, history.seq, len(pixels_bin)))
+        message = DeltaFrame.encode(history.seq, pixels_bin)
+        self.sendMessage(message, isBinary=True)
+        self.note_written(message)
+        self.synced_seq = history.seq
+        self.held = []
+
+    def send_snapshot(self, seq, compressed_bin):
+        if self not in self.server.clients:
+            return
+        if self.synced_seq is not None and seq <= self.synced_seq:
+            return
+        # a slow link would otherwise be paused, and then evicted, by its
+        # own snapshot
+        self.transport.bufferSize = (self.server.high_water_bytes +
+                                     len(compressed_bin))
         self.sendMessage(compressed_bin, isBinary=True)
+        self.after_snapshot = 0
+        if not self.server.json_updates:
+            # an empty delta tells the client which seq the snapshot is at
+            self.send_message(DeltaFrame.encode(seq, b''))
+        self.synced_seq = seq
+        for held_seq, message in self.held:
+            if held_seq > seq:
+                self.send_message(message)
+                self.synced_seq = held_seq
+        self.held = []
+
+    def send_update(self, seq, message):
+        if self.synced_seq is None:
+            self.held.append((seq, message))
+            return
+        if self.pressure.is_paused() or self.behind:
+            self.behind = True
+            self.skipped_updates += 1
+            return
+        self.send_message(message)
+        self.synced_seq = seq
+
+    def send_message(self, message):
+        self.sendMessage(message, isBinary=not self.server.json_updates)
+        self.note_written(message)
+
+    def note_written(self, message):
+        if self.after_snapshot is not None:
+            self.after_snapshot += len(message)
+            self.check_snapshot_sent()
 
     def onMessage(self, payload, isBinary):
-        print("got message?")
+        if isBinary:
+            print("unexpected binary message")
+            return
+        try:
+            message = json.loads(payload.decode("utf8"))
+        except Exception:
+            print("could not parse client message")
+            return
+        if not isinstance(message, dict):
+            print("unexpected client message")
+            return
+        if 'resume' in message and isinstance(message['resume'], int):
+            self.catch_up(message['resume'])
+        if 'subscribe' in message:
+            self.subscribe(message['subscribe'])
+
+    def parse_subscription(self, subscription):
+        # {"x": .., "y": .., "width": .., "height": ..} for a rectangle,
+        # {"tiles": [..]} for a set of tile ids or null for everything
+        if subscription is None:
+            return None, None
+        if not isinstance(subscription, dict):
+            return None, "unexpected subscription"
+        if 'tiles' in subscription:
+            tiles = subscription['tiles']
+            if not isinstance(tiles, list):
+                return None, "tiles must be a list"
+            for t in tiles:
+                if not isinstance(t, int) or t < 0 or t >= N_SUB_TILES:
+                    return None, "bad tile id"
+            return set(tiles), None
+        try:
+            x = subscription['x']
+            y = subscription['y']
+            width = subscription['width']
+            height = subscription['height']
+        except KeyError:
+            return None, "rectangle needs x, y, width and height"
+        if not all(isinstance(v, int) for v in (x, y, width, height)):
+            return None, "rectangle values must be integers"
+        return Subscriptions.tiles_for_rect(x, y, width, height)
+
+    def subscribe(self, subscription):
+        tiles, err = self.parse_subscription(subscription)
+        if err:
+            print("bad subscription from %s: %s" % (self.peer, err))
+            return
+        print("client %s subscribed to %s tiles" % (
+              self.peer, "all" if tiles is None else len(tiles)))
+        widened = self.server.subscriptions.subscribe(self, tiles)
+        # updates to the newly covered area were not sent to this client so
+        # it needs a fresh snapshot
+        if widened and self.synced_seq is not None:
+            self.catch_up(None)
 
     def onClose(self, wasClean, code, reason):
         print("WebSocket connection closed: {0}".format(reason))
+        if self in self.server.clients:
+            self.server.clients.remove(self)
+        self.server.subscriptions.unsubscribe(self)
 
 ###############################################################################
 
 class AppServer(WebSocketServerFactory):
-    def __init__(self, port, app):
+    def __init__(self, port, app, json_updates, coalesce_ms, high_water_bytes,
+                 slow_client_seconds):
         ws_url = u"ws://0.0.0.0:%d" % port
         super().__init__()
         self.setProtocolOptions(openHandshakeTimeout=15, autoPingInterval=30,
@@ -59,17 +266,96 @@ class AppServer(WebSocketServerFactory):
         self.protocol = AppClient
         self.protocol.server = self
         self.clients = []
+        self.subscriptions = Subscriptions()
         print("listening on websocket %s" % ws_url)
         reactor.listenTCP(port, self)
         self.app = app
+        self.json_updates = json_updates
+        self.coalescer = Coalescer()
+        self.coalesce_ms = coalesce_ms
+        if self.coalesce_ms > 0:
+            self.coalesce_loop = LoopingCall(self.coalesce_tick)
+            self.coalesce_loop.start(interval=self.coalesce_ms / 1000.0,
+                                     now=False)
+        self.high_water_bytes = high_water_bytes
+        self.slow_client_seconds = slow_client_seconds
+        self.slow_client_loop = LoopingCall(self.drop_slow_clients)
+        self.slow_client_loop.start(interval=SLOW_CLIENT_CHECK, now=False)
+        self.metrics_loop = LoopingCall(self.print_metrics)
+        self.metrics_loop.start(interval=METRICS_SECONDS, now=False)
+        self.evicted = 0
+
+    ###########################################################################
 
-    def echo_to_clients(self, pixels):
-        pixels = [{'x': p.x, 'y': p.y, 'rgb': p.rgb} for p in pixels]
+    def drop_slow_clients(self):
+        now = time.time()
+        for c in list(self.clients):
+            c.check_snapshot_sent()
+            snapshot_backlog = (c.backlog_bytes() if c.snapshot_in_flight()
+                                else None)
+            if not c.pressure.is_stuck(snapshot_backlog, now=now):
+                continue
+            print("dropping client %s stuck with %s bytes buffered" % (
+                  c.peer, c.backlog_bytes()))
+            self.clients.remove(c)
+            self.subscriptions.unsubscribe(c)
+            self.evicted += 1
+            c.dropConnection(abort=True)
+
+    def metrics(self):
+        return {'clients':  len(self.clients),
+                'paused':   sum(1 for c in self.clients if
+                                c.pressure.is_paused()),
+                'behind':   sum(1 for c in self.clients if c.behind),
+                'evicted':  self.evicted,
+                'backlogs': {c.peer: c.backlog_bytes() for c in self.clients
+                             if c.backlog_bytes()},
+                'coalesce': self.coalescer.stats(),
+                'unpaid':   self.app.unpaid_htlcs.stats(),
+                'early':    self.app.early_settlements.stats()}
+
+    def print_metrics(self):
+        print("server metrics: %s" % json.dumps(self.metrics()))
+
+    ###########################################################################
+
+    def json_message(self, pixels_bin):
+        xs, ys, rgbs = Pixel.unpack_arrays(pixels_bin)
+        pixels = [{'x': x, 'y': y, 'rgb': "%03x" % rgb} for x, y, rgb in
+                  zip(xs, ys, rgbs)]
         message = {'pixels':   pixels}
-        message = json.dumps(message)
-        print("echoing to clients: %s" % message)
-        for c in self.clients:
-            c.sendMessage(message.encode("utf8"))
+        return json.dumps(message).encode("utf8")
+
+    def echo_to_clients(self, seq, pixels_bin):
+        # serialized once, the same bytes go to every client
+        if self.json_updates:
+            message = self.json_message(pixels_bin)
+        else:
+            message = DeltaFrame.encode(seq, pixels_bin)
+        tiles = Subscriptions.tiles_for_packed(pixels_bin)
+        recipients = self.subscriptions.recipients(tiles)
+        print("echoing seq %d to %d of %d clients: %d pixels, %d bytes" % (
+              seq, len(recipients), len(self.clients),
+              len(pixels_bin) // PIXEL_BYTE_SIZE, len(message)))
+        for c in recipients:
+            c.send_update(seq, message)
+        return len(message)
+
+    def queue_update(self, seq, pixels_bin):
+        if self.coalesce_ms == 0:
+            self.echo_to_clients(seq, pixels_bin)
+            return
+        self.coalescer.add(seq, pixels_bin)
+
+    def coalesce_tick(self):
+        if not self.coalescer.has_pending():
+            return
+        seq, pixels_bin = self.coalescer.take()
+        message_len = self.echo_to_clients(seq, pixels_bin)
+        tick = self.coalescer.stats()['last_tick']
+        print("coalesced %d batches, %d pixels into %d pixels, %d bytes" % (
+              tick['batches'], tick['pixels_in'], tick['pixels_out'],
+              message_len))
 
 ###############################################################################
 
@@ -77,24 +363,77 @@ HTLC_ACCEPTED_TAG = "htlc_accepted".encode("utf8")
 FORWARD_EVENT_TAG = "forward_event".encode("utf8")
 
 class App(object):
-    def __init__(self, endpoint, mock_endpoint, port, art_db_dir):
+    def __init__(self, endpoint, mock_endpoint, port, art_db_dir,
+                 log_sync_records, log_sync_ms, checkpoint_seconds,
+                 json_updates, coalesce_ms, history_batches,
+                 high_water_bytes, slow_client_seconds):
         self.endpoint = endpoint
         self.mock_endpoint = mock_endpoint
         self.port = port
         self.art_db_dir = art_db_dir
-        self.unpaid_htlcs = {}
+        self.log_sync_records = log_sync_records
+        self.log_sync_ms = log_sync_ms
+        self.checkpoint_seconds = checkpoint_seconds
+        self.json_updates = json_updates
+        self.coalesce_ms = coalesce_ms
+        self.history_batches = history_batches
+        self.high_water_bytes = high_water_bytes
+        self.slow_client_seconds = slow_client_seconds
+        self.early_settlements = EarlySettlements(EARLY_SETTLEMENT_SECONDS,
+                                                  EARLY_SETTLEMENT_MAX)
         self.prune_loop = LoopingCall(self.prune_unpaid)
         self.prune_loop.start(interval=UNPAID_PRUNE_CHECK, now=False)
 
     ###########################################################################
 
+    def pending_path(self):
+        return os.path.join(self.art_db_dir, "pending.bin")
+
+    def setup_pending(self):
+        if not os.path.exists(self.art_db_dir):
+            os.makedirs(self.art_db_dir)
+        store = PendingStore(self.pending_path(),
+                             sync_records=self.log_sync_records,
+                             sync_ms=self.log_sync_ms)
+        self.unpaid_htlcs = PendingHtlcs(UNPAID_PRUNE_SECONDS, store=store)
+        for payment_hash, recv_time, payload in store.load(
+                UNPAID_PRUNE_SECONDS):
+            htlc, err = self.decode_htlc(payload, recv_time)
+            if err:
+                print("could not restore pending htlc: %s" % err)
+                continue
+            self.unpaid_htlcs.restore(payment_hash, htlc)
+        print("restored %d pending htlcs" % len(self.unpaid_htlcs))
+
+    def sync_logs(self):
+        # settled pixels have to be durable in updates.bin before the
+        # removals of their htlcs reach pending.bin
+        store = self.unpaid_htlcs.store
+        self.art_db.sync_log(force=store.has_removals())
+        store.write_removals()
+        store.sync()
+
+    ###########################################################################
+
     def setup_art_db(self):
-        self.art_db = ArtDb(self.art_db_dir)
+        self.art_db = ArtDb(self.art_db_dir,
+                            sync_records=self.log_sync_records,
+                            sync_ms=self.log_sync_ms)
+        self.snapshot = Snapshot(self.art_db)
+        self.history = History(self.art_db.seq,
+                               max_batches=self.history_batches)
+        self.log_sync_loop = LoopingCall(self.sync_logs)
+        self.log_sync_loop.start(interval=self.log_sync_ms / 1000.0,
+                                 now=False)
+        self.checkpoint_loop = LoopingCall(self.art_db.checkpoint)
+        self.checkpoint_loop.start(interval=self.checkpoint_seconds, now=False)
 
     ###########################################################################
 
     def setup_websocket(self):
-        self.ws_server = AppServer(self.port, self)
+        self.ws_server = AppServer(self.port, self, self.json_updates,
+                                   self.coalesce_ms, self.high_water_bytes,
+                                   self.slow_client_seconds)
 
     ###########################################################################
 
@@ -123,8 +462,41 @@ class App(object):
             print("invoice is not settled")
             return
 
-        if d['payment_hash'] in self.unpaid_htlcs.keys():
-            self.finish_htlc(d['payment_hash'])
+        payment_hash = d['payment_hash']
+        htlc = self.unpaid_htlcs.pop(payment_hash)
+        if htlc is None:
+            fee = self.forward_fee_msat(d)
+            if fee is not None and fee < MIN_PIXEL_FEE_MSAT:
+                self.early_settlements.note_not_pixel()
+                return
+            print("settled before its htlc was seen, holding on to it")
+            self.early_settlements.add(payment_hash)
+            return
+        self.early_settlements.note_in_order()
+        self.finish_htlc(payment_hash, htlc)
+        self.unpaid_htlcs.settled(payment_hash)
+
+    def forward_fee_msat(self, d):
+        # newer nodes give fee_msat as "<n>msat", older ones fee as an int.
+        # None if it can't be told, in which case the forward is kept.
+        fee = d.get('fee_msat', d.get('fee'))
+        if isinstance(fee, str) and fee.endswith("msat"):
+            fee = fee[:-4]
+        try:
+            return int(fee)
+        except (TypeError, ValueError):
+            return None
+
+    def decode_htlc(self, payload, recv_time):
+        parsed_payload, err = Extension.parse(payload)
+        if err:
+            return None, err
+        pixels_bin = parsed_payload['tlvs'][PIXEL_TLV_TYPE]['pixels_bin']
+        # keep the decoded pixels so settling is just a lookup and an apply
+        return {'payload':    payload,
+                'pixels_bin': pixels_bin,
+                'n_pixels':   len(pixels_bin) // PIXEL_BYTE_SIZE,
+                'recv_time':  recv_time}, None
 
     def htlc_accepted_message(self, message):
         d = json.loads(message.decode('utf8'))
@@ -134,27 +506,27 @@ class App(object):
         payload_hex = d['onion']['payload']
         payload = h2b(payload_hex)
         paid = amount - forward_amount
-        parsed_payload, err = Extension.parse(payload)
+        htlc, err = self.decode_htlc(payload, time.time())
         if err:
             print("could not parse payload: %s" % err)
+            self.early_settlements.discard(payment_hash)
             return
-        print("parsed payload %s" % parsed_payload)
-        pixels = parsed_payload['tlvs'][PIXEL_TLV_TYPE]['pixels']
-        if (amount - forward_amount) < len(pixels) * 1000:
+        print("parsed payload with %d pixels" % htlc['n_pixels'])
+        if (amount - forward_amount) < htlc['n_pixels'] * 1000:
             print("forward fee not enough")
+            self.early_settlements.discard(payment_hash)
             return
+        if self.early_settlements.take(payment_hash):
+            print("htlc was already settled, finishing")
+            self.finish_htlc(payment_hash, htlc)
+            return
+        self.unpaid_htlcs.add(payment_hash, htlc)
 
-        self.unpaid_htlcs[payment_hash] = {'payload_hex': payload_hex,
-                                           'recv_time':   time.time()}
-
-    def finish_htlc(self, payment_hash):
-        payload_hex = self.unpaid_htlcs.pop(payment_hash)['payload_hex']
-        payload = h2b(payload_hex)
-        parsed_payload, err = Extension.parse(payload)
-        assert err is None, "could not parse the second time?"
-        pixels = parsed_payload['tlvs'][PIXEL_TLV_TYPE]['pixels']
-        self.art_db.record_pixels(payload_hex, pixels)
-        self.ws_server.echo_to_clients( pixels)
+    def finish_htlc(self, payment_hash, htlc):
+        seq = self.art_db.record_pixels(h2b(payment_hash), htlc['payload'],
+                                        htlc['pixels_bin'])
+        self.history.add(seq, htlc['pixels_bin'])
+        self.ws_server.queue_update(seq, htlc['pixels_bin'])
 
     def zmq_message(self, message, tag):
         if tag == FORWARD_EVENT_TAG:
@@ -167,21 +539,28 @@ class App(object):
     ###########################################################################
 
     def prune_unpaid(self):
-        now = time.time()
-        new = {k: v for k, v in self.unpaid_htlcs.items() if
-               (now - v['recv_time']) < UNPAID_PRUNE_SECONDS}
-        #print("pruning: %d to %d" % (len(self.unpaid_htlcs), len(new)))
-        self.unpaid_htlcs = new
+        evicted = self.unpaid_htlcs.expire()
+        if evicted > 0:
+            print("pruned unpaid htlcs: %s" %
+                  json.dumps(self.unpaid_htlcs.stats()))
+        expired = self.early_settlements.expire()
+        if expired > 0:
+            print("expired early settlements: %s" %
+                  json.dumps(self.early_settlements.stats()))
 
     ###########################################################################
 
     def run(self):
         self.setup_websocket()
         self.setup_zmq()
+        self.setup_pending()
         self.setup_art_db()
 
     def stop(self):
+        # unmapping syncs updates.bin, after which removals are safe to write
         self.art_db.unmap_art_bin()
+        self.unpaid_htlcs.store.write_removals()
+        self.unpaid_htlcs.store.close()
 
 
 ###############################################################################
@@ -207,10 +586,41 @@ parser.add_argument("-w", "--websocket-port", type=int,
                     help="port to listen for incoming websocket connections")
 parser.add_argument("-a", "--art-db-dir", type=str, default=DEFAULT_ART_DB_DIR,
                     help="directory to save the image state and logs")
+parser.add_argument("--log-sync-records", type=int,
+                    default=DEFAULT_SYNC_RECORDS,
+                    help="fsync the update log after this many records")
+parser.add_argument("--log-sync-ms", type=int, default=DEFAULT_SYNC_MS,
+                    help="fsync the update log when this many milliseconds "
+                         "have passed since the last sync")
+parser.add_argument("--checkpoint-seconds", type=int,
+                    default=CHECKPOINT_SECONDS,
+                    help="how often to write the image state out to disk")
+parser.add_argument("-j", "--json-updates", action="store_true",
+                    help="send pixel updates to clients as JSON text instead "
+                         "of binary delta frames, for older frontends")
+parser.add_argument("-c", "--coalesce-ms", type=int, default=COALESCE_MS,
+                    help="window in milliseconds over which settled pixels "
+                         "are merged into one update to clients, 0 sends "
+                         "each update immediately")
+parser.add_argument("--history-batches", type=int,
+                    default=DEFAULT_HISTORY_BATCHES,
+                    help="how many recent pixel batches to keep for catching "
+                         "up reconnecting clients without a full snapshot")
+parser.add_argument("--high-water-bytes", type=int, default=HIGH_WATER_BYTES,
+                    help="outbound bytes buffered for a client, on top of "
+                         "its snapshot, before it stops being sent updates "
+                         "and is caught up later")
+parser.add_argument("--slow-client-seconds", type=int,
+                    default=SLOW_CLIENT_SECONDS,
+                    help="disconnect a client that stays past the high-water "
+                         "mark for this long")
 settings = parser.parse_args()
 
 a = App(settings.endpoint, settings.mock_endpoint, settings.websocket_port,
-        settings.art_db_dir)
+        settings.art_db_dir, settings.log_sync_records, settings.log_sync_ms,
+        settings.checkpoint_seconds, settings.json_updates,
+        settings.coalesce_ms, settings.history_batches,
+        settings.high_water_bytes, settings.slow_client_seconds)
 a.run()
 
 
@@ -2,8 +2,13 @@
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php
 import os
-import time
 import mmap
+import struct
+
+from onionstudio.update_log import UpdateLog
+from onionstudio.update_log import DEFAULT_SYNC_RECORDS, DEFAULT_SYNC_MS
+from onionstudio.extension import Extension, PIXEL_TLV_TYPE
+from onionstudio.pixel_batch import PixelBatch
 
 
 PIXEL_RECORD_BIT_SIZE = 12
@@ -12,15 +17,43 @@ BITS_PER_BYTE = 8
 WIDTH = 1024
 HEIGHT = 1024
 
+# Tiles are bands of whole columns since that is what is contiguous in the
+# studio.dat layout and so can be compressed independently of its neighbours.
+TILE_COLUMNS = 64
+N_TILES = WIDTH // TILE_COLUMNS
+TILE_PIXELS = TILE_COLUMNS * HEIGHT
+
+# batches at least this big are written with numpy if it is installed
+NUMPY_MIN_PIXELS = 128
+
+# |---4 byte magic---|---u64 update log offset---|---u64 seq---|
+#
+# Records how far into the update log studio.dat is known to reflect and the
+# sequence number of the last update at that point.
+CHECKPOINT_MAGIC = b"OSCK"
+CHECKPOINT_FORMAT = struct.Struct(">4sQQ")
+
 
 class ArtDb(object):
-    def __init__(self, art_db_dir):
+    def __init__(self, art_db_dir, sync_records=DEFAULT_SYNC_RECORDS,
+                 sync_ms=DEFAULT_SYNC_MS):
         if not os.path.exists(art_db_dir):
             os.makedirs(art_db_dir)
         self.art_db_dir = art_db_dir
         self.n_pixels = WIDTH * HEIGHT
         self.size = ArtDb.total_bytes()
-        self.mmap_art_bin()
+        # bumped on every recorded update so cached views of the canvas can
+        # tell whether they are stale, carried across restarts by the
+        # checkpoint and log replay
+        self.seq = 0
+        self.dirty_tiles = set(range(N_TILES))
+        fresh = self.mmap_art_bin()
+        offset, self.seq = (0, 0) if fresh else self.read_checkpoint()
+        self.convert_text_log()
+        self.recover(offset)
+        self.update_log = UpdateLog(self.update_log_path(),
+                                    sync_records=sync_records, sync_ms=sync_ms)
+        self.checkpoint()
 
     def total_bytes():
         total_pixels = WIDTH * HEIGHT
@@ -32,8 +65,15 @@ class ArtDb(object):
         return os.path.join(self.art_db_dir, "studio.dat")
 
     def update_log_path(self):
+        return os.path.join(self.art_db_dir, "updates.bin")
+
+    def text_log_path(self):
+        # the update log before it was binary
         return os.path.join(self.art_db_dir, "updates.log")
 
+    def checkpoint_path(self):
+        return os.path.join(self.art_db_dir, "checkpoint.dat")
+
     ###########################################################################
 
     def mmap_file_init(self, path):
@@ -45,22 +85,100 @@ class ArtDb(object):
 
     def mmap_art_bin(self):
         path = self.art_path()
-        if not os.path.exists(path):
+        fresh = not os.path.exists(path)
+        if fresh:
             self.mmap_file_init(path)
         self.file_ref = open(path, "r+b")
         self.bin = mmap.mmap(self.file_ref.fileno(), self.size)
+        return fresh
 
     def unmap_art_bin(self):
-        self.bin.flush()
+        self.checkpoint()
+        self.update_log.close()
         self.bin.close()
         self.file_ref.close()
 
-    def log_payload(self, payload):
+    ###########################################################################
+
+    def read_checkpoint(self):
+        path = self.checkpoint_path()
+        if not os.path.exists(path):
+            return 0, 0
+        with open(path, "rb") as f:
+            checkpoint_bin = f.read()
+        if len(checkpoint_bin) != CHECKPOINT_FORMAT.size:
+            print("unexpected checkpoint size, replaying full update log")
+            return 0, 0
+        magic, offset, seq = CHECKPOINT_FORMAT.unpack(checkpoint_bin)
+        if magic != CHECKPOINT_MAGIC:
+            print("bad checkpoint magic, replaying full update log")
+            return 0, 0
+        return offset, seq
+
+    def write_checkpoint(self, offset, seq):
+        # write-then-rename so a crash leaves either the old or the new
+        # checkpoint, never a torn one
+        path = self.checkpoint_path()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(CHECKPOINT_FORMAT.pack(CHECKPOINT_MAGIC, offset, seq))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def convert_text_log(self):
+        # A directory from before the binary log has its history in
+        # updates.log. It is converted once, when there is no updates.bin
+        # yet, and then replayed from the start like any other log, which
+        # leaves studio.dat as it was since those writes already reached it.
+        text_path = self.text_log_path()
         path = self.update_log_path()
-        s = "%0.4f payload %s\n" % (time.time(), payload)
-        f = open(path, "a")
-        f.write(s)
-        f.close()
+        if not os.path.exists(text_path) or os.path.exists(path):
+            return
+        converted, skipped = UpdateLog.convert_text_log(text_path, path)
+        print("converted %d updates from %s to %s, skipped %d unreadable "
+              "lines" % (converted, text_path, path, skipped))
+
+    def recover(self, offset):
+        # Re-applies every update logged after the checkpoint. Pixel writes
+        # are last-write-wins, so replaying records whose effects already
+        # reached studio.dat before a crash is harmless.
+        end_offset = offset
+        replayed = 0
+        for end_offset, _, _, payload in UpdateLog.iter_records(
+                self.update_log_path(), offset):
+            self.seq += 1
+            parsed_payload, err = Extension.parse(payload)
+            if err:
+                print("could not parse logged payload: %s" % err)
+                continue
+            self.write_packed(
+                parsed_payload['tlvs'][PIXEL_TLV_TYPE]['pixels_bin'])
+            replayed += 1
+        print("replayed %d logged updates from offset %d, now at seq %d" % (
+              replayed, offset, self.seq))
+        # drop any torn record at the end so new appends start clean
+        path = self.update_log_path()
+        if os.path.exists(path) and os.path.getsize(path) > end_offset:
+            print("truncating partial update log record at %d" % end_offset)
+            os.truncate(path, end_offset)
+
+    ###########################################################################
+
+    def sync_log(self, force=False):
+        if force:
+            self.update_log.sync()
+        else:
+            self.update_log.maybe_sync()
+
+    def checkpoint(self):
+        # the log is the durable record of each update, studio.dat is only
+        # materialized to disk here rather than on every settled payment
+        self.update_log.sync()
+        self.bin.flush()
+        self.write_checkpoint(self.update_log.offset(), self.seq)
+
+    ###########################################################################
 
     def map_bit(self, x, y):
         return ((x * PIXEL_RECORD_BIT_SIZE * HEIGHT) +
@@ -93,13 +211,88 @@ class ArtDb(object):
         self.bin[byte:byte + 2] = value_bin
         print("wrote at %d: %s" % (byte, value_bin.hex()))
 
-    def record_pixels(self, payload, pixels):
-        for p in pixels:
-            print("writing: %d %d = %s" % (p.x, p.y, p.rgb))
-            self.write_rgb(p.x, p.y, p.rgb)
-            assert self.read_rgb(p.x, p.y) == p.rgb
-        self.log_payload(payload)
-        self.bin.flush()
+    ###########################################################################
+
+    def _apply_values(self, values):
+        # Batch equivalent of write_rgb(). Takes (index, rgb_value) tuples
+        # where index is (x * HEIGHT) + y so the bit offset is just
+        # index * 12. Even indexes start on a byte boundary and own the whole
+        # first byte plus the high nibble of the second, odd indexes own the
+        # low nibble of the first byte plus the whole second byte. Later
+        # values for the same index win, same as calling write_rgb() in order.
+        b = self.bin
+        dirty = self.dirty_tiles
+        for index, rgb_value in values:
+            dirty.add(index // TILE_PIXELS)
+            byte = (index * 3) >> 1
+            if index & 1:
+                b[byte] = (b[byte] & 0xf0) | (rgb_value >> 8)
+                b[byte + 1] = rgb_value & 0xff
+            else:
+                b[byte] = rgb_value >> 4
+                b[byte + 1] = (b[byte + 1] & 0x0f) | ((rgb_value & 0x0f) << 4)
+
+    def _numpy_apply(self, numpy, vals):
+        # Same as _apply_values() over the whole batch at once. Only the last
+        # value for each index is kept so every byte is assigned once per
+        # pass. Even indexes are written before odd ones since an even index
+        # and the odd one after it share a byte.
+        vals = numpy.frombuffer(vals, dtype=numpy.uint32)[::-1]
+        indexes, last = numpy.unique(vals >> 12, return_index=True)
+        rgbs = vals[last] & 0x0fff
+        self.dirty_tiles.update((indexes // TILE_PIXELS).tolist())
+        b = numpy.frombuffer(self.bin, dtype=numpy.uint8)
+        bytes_at = (indexes * 3) >> 1
+        odd = (indexes & 1).astype(bool)
+        even = ~odd
+        byte, rgb = bytes_at[even], rgbs[even]
+        b[byte] = rgb >> 4
+        b[byte + 1] = (b[byte + 1] & 0x0f) | ((rgb & 0x0f) << 4)
+        byte, rgb = bytes_at[odd], rgbs[odd]
+        b[byte] = (b[byte] & 0xf0) | (rgb >> 8)
+        b[byte + 1] = rgb & 0xff
+        # the mmap can't be closed while a view of it is alive
+        del b
+
+    def write_pixels(self, pixels):
+        self._apply_packed(PixelBatch.from_pixels(pixels).vals)
+
+    def _apply_packed(self, vals):
+        # records are laid out as Pixel.to_bin() produces them:
+        # |---10 bit x---|---10 bit y---|---12 bit rgb---|
+        # so with HEIGHT == 1024 the top 20 bits are already the index.
+        # Small batches are quicker without numpy's per-call overhead.
+        if len(vals) >= NUMPY_MIN_PIXELS:
+            try:
+                import numpy
+            except ImportError:
+                numpy = None
+            if numpy:
+                self._numpy_apply(numpy, vals)
+                return
+        self._apply_values((val >> 12, val & 0x0fff) for val in vals)
+
+    def write_packed(self, pixels_bin):
+        self._apply_packed(PixelBatch.from_bin(pixels_bin).vals)
+
+    def record_pixels(self, payment_hash, payload, pixels_bin):
+        self.update_log.append(payment_hash, payload)
+        self.write_packed(pixels_bin)
+        self.seq += 1
+        return self.seq
+
+    ###########################################################################
+
+    def tile_bytes():
+        return ArtDb.total_bytes() // N_TILES
+
+    def take_dirty_tiles(self):
+        dirty = self.dirty_tiles
+        self.dirty_tiles = set()
+        return dirty
+
+    def mark_dirty_tiles(self, tiles):
+        self.dirty_tiles.update(tiles)
 
     def to_bin(self):
         return bytes(self.bin)
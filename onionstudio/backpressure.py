@@ -0,0 +1,45 @@
+# Copyright (c) 2020 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+import time
+
+
+class Backpressure(object):
+    """
+    Keeps track of how long a websocket client has been past its high-water
+    mark, to decide when it is stuck and should be dropped. The clock starts
+    at the first pause and keeps running through the repeated pauses Twisted
+    signals on every further write, pings included, until the buffer drains.
+
+    While the client's snapshot is still in its buffer the clock is restarted
+    each time the backlog is seen to shrink, so a slow link working through
+    a big snapshot isn't mistaken for a stuck one.
+    """
+    def __init__(self, slow_seconds):
+        self.slow_seconds = slow_seconds
+        self.paused_at = None
+        self.last_backlog = None
+
+    def is_paused(self):
+        return self.paused_at is not None
+
+    def paused(self, now=None):
+        if self.paused_at is None:
+            self.paused_at = time.time() if now is None else now
+
+    def resumed(self):
+        self.paused_at = None
+        self.last_backlog = None
+
+    def is_stuck(self, snapshot_backlog=None, now=None):
+        """ snapshot_backlog is the buffered byte count if the snapshot is
+            still in flight, None otherwise """
+        if self.paused_at is None:
+            return False
+        now = time.time() if now is None else now
+        if snapshot_backlog is not None:
+            if (self.last_backlog is None or
+                    snapshot_backlog < self.last_backlog):
+                self.paused_at = now
+            self.last_backlog = snapshot_backlog
+        return (now - self.paused_at) >= self.slow_seconds
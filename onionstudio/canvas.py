@@ -0,0 +1,73 @@
+# Copyright (c) 2020 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+import os
+import zlib
+import gzip
+import array
+
+from onionstudio.pixel_batch import PixelBatch
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# the size of studio.dat, 1024x1024 pixels of 12 bits each. Worked out here
+# rather than taken from ArtDb so the draw clients don't pull in the server
+# side modules.
+CANVAS_BYTES = (1024 * 1024 * 12) // 8
+
+
+class Canvas:
+    """
+    A read-only copy of the canvas in the studio.dat layout, used by the draw
+    clients to leave out pixels that are already the color being drawn. It
+    can be loaded from a studio.dat file or from a saved copy of the gzip
+    snapshot the server sends to websocket clients.
+    """
+    def __init__(self, art_bin):
+        assert len(art_bin) == CANVAS_BYTES
+        self.art_bin = art_bin
+
+    def load(path):
+        if not os.path.isfile(path):
+            return None, "no canvas file at path: %s" % path
+        with open(path, "rb") as f:
+            art_bin = f.read()
+        if art_bin.startswith(GZIP_MAGIC):
+            try:
+                art_bin = gzip.decompress(art_bin)
+            except (OSError, EOFError, zlib.error) as e:
+                return None, "could not decompress canvas: %s" % e
+        if len(art_bin) != CANVAS_BYTES:
+            return None, "canvas is %d bytes, expected %d" % (len(art_bin),
+                                                              CANVAS_BYTES)
+        return Canvas(art_bin), None
+
+    ###########################################################################
+
+    def rgb_at_index(self, index):
+        # same 12 bit packing as ArtDb._apply_values(), index is
+        # (x * HEIGHT) + y
+        b = self.art_bin
+        byte = (index * 3) >> 1
+        if index & 1:
+            return ((b[byte] & 0x0f) << 8) | b[byte + 1]
+        return (b[byte] << 4) | (b[byte + 1] >> 4)
+
+    def diff(self, pixels):
+        """ returns a PixelBatch of the pixels that would change the canvas,
+            in their original order. A pixel is dropped if the canvas already
+            has its color at that point in the drawing, taking into account
+            earlier pixels of the same drawing at the same coordinate. """
+        drawn = {}
+        vals = array.array("I")
+        for val in PixelBatch.from_pixels(pixels).vals:
+            index = val >> 12
+            rgb = val & 0x0fff
+            current = drawn.get(index)
+            if current is None:
+                current = self.rgb_at_index(index)
+            if current == rgb:
+                continue
+            drawn[index] = rgb
+            vals.append(val)
+        return PixelBatch(vals)
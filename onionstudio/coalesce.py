@@ -0,0 +1,63 @@
+# Copyright (c) 2020 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+import array
+
+from onionstudio.pixel import PIXEL_BYTE_SIZE
+from onionstudio.pixel_batch import PixelBatch
+
+
+class Coalescer(object):
+    """
+    Collects the pixel batches settled within one broadcast window so they
+    can go out to clients as a single update. Pixels are deduplicated by
+    coordinate with the last write winning, and stats are kept for the most
+    recent tick and in total so the window length can be tuned.
+    """
+    def __init__(self):
+        self.pending = {}
+        self.seq = None
+        self.batches = 0
+        self.pixels_in = 0
+        self.last_tick = None
+        self.totals = {'ticks':      0,
+                       'batches':    0,
+                       'pixels_in':  0,
+                       'pixels_out': 0}
+
+    def add(self, seq, pixels_bin):
+        for val in PixelBatch.from_bin(pixels_bin).vals:
+            # keyed by the x and y bits, re-inserted so the dict order
+            # follows the latest write
+            index = val >> 12
+            self.pending.pop(index, None)
+            self.pending[index] = val
+        self.seq = seq
+        self.batches += 1
+        self.pixels_in += len(pixels_bin) // PIXEL_BYTE_SIZE
+
+    def has_pending(self):
+        return len(self.pending) > 0
+
+    def take(self):
+        """ returns the latest seq and the merged packed pixels, recording
+            stats for this tick. """
+        seq = self.seq
+        pixels_out = len(self.pending)
+        merged = PixelBatch(array.array("I", self.pending.values()))
+        pixels_bin = merged.to_bytes()
+        self.last_tick = {'batches':    self.batches,
+                          'pixels_in':  self.pixels_in,
+                          'pixels_out': pixels_out}
+        self.totals['ticks'] += 1
+        self.totals['batches'] += self.batches
+        self.totals['pixels_in'] += self.pixels_in
+        self.totals['pixels_out'] += pixels_out
+        self.pending = {}
+        self.batches = 0
+        self.pixels_in = 0
+        return seq, pixels_bin
+
+    def stats(self):
+        return {'last_tick': self.last_tick,
+                'totals':    dict(self.totals)}
@@ -2,6 +2,7 @@
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php
 import zlib
+import struct
 
 def compressor(bin_to_compress):
         wbits = zlib.MAX_WBITS | 16
@@ -9,3 +10,22 @@ def compressor(bin_to_compress):
         a = compress_obj.compress(bin_to_compress)
         b = compress_obj.flush()
         return a + b
+
+# The pieces below let the gzip stream be assembled from independently
+# compressed chunks. Each chunk is a raw deflate stream flushed with
+# Z_SYNC_FLUSH, which ends it on a byte boundary without a final block and
+# without back-references into other chunks, so chunks can be concatenated
+# and then terminated with an empty final block.
+
+GZIP_HEADER = bytes([0x1f, 0x8b, 0x08, 0, 0, 0, 0, 0, 0, 0xff])
+DEFLATE_END = zlib.compressobj(wbits=-zlib.MAX_WBITS).flush()
+
+def chunk_compressor(chunk):
+    compress_obj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return compress_obj.compress(chunk) + compress_obj.flush(zlib.Z_SYNC_FLUSH)
+
+def assemble_chunks(compressed_chunks, uncompressed):
+    trailer = struct.pack("<II", zlib.crc32(uncompressed),
+                          len(uncompressed) & 0xffffffff)
+    return (GZIP_HEADER + b''.join(compressed_chunks) + DEFLATE_END +
+            trailer)
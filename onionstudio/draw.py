@@ -1,23 +1,42 @@
 # Copyright (c) 2020 Jarret Dyrbye
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php
-import time
 import uuid
+import bisect
 import pprint
 
-from onionstudio.invoice import Invoice
+from pyln.client import RpcError
+
+from onionstudio.invoice import InvoicePool
 from onionstudio.onion import Onion
+from onionstudio.route_cache import RouteCache
 
-WAIT_FOR_PAYMENT_CHECKS = 20
-WAIT_FOR_PAYMENT_PERIOD = 2.0
+PAYMENT_TIMEOUT = 60 # seconds
+WAITSENDPAY_TIMED_OUT = 2000 # c-lightning's error code for a timed out wait
+DEFAULT_IN_FLIGHT = 4
+MAX_FAILURES = 3
 
 class Draw:
-    def __init__(self, rpc, dst_node, pixels):
+    def __init__(self, rpc, dst_node, pixels, in_flight=DEFAULT_IN_FLIGHT):
+        """
+        Draws the pixels with up to in_flight onions pending at a time, each
+        paying its own invoice. Pixels are tracked as ranges of offsets into
+        the drawing so a failed payment puts exactly its range back in the
+        queue to be sent again.
+        """
         self.rpc = rpc
         self.dst_node = dst_node
         self.pixels = pixels
         self.total_pixels = len(self.pixels)
         self.pixels_drawn = 0
+        self.max_in_flight = max(1, in_flight)
+        self.queued = [(0, self.total_pixels)] if self.total_pixels else []
+        self.in_flight = []
+        self.unresolved = []
+        self.failures = 0
+        self.route_cache = RouteCache(rpc)
+        # one invoice ready beyond those paying for onions in flight
+        self.invoices = InvoicePool(rpc, self.max_in_flight + 1)
 
     ###########################################################################
 
@@ -36,13 +55,27 @@ class Draw:
         except:
             return None
 
-    def _payment_status(self, payment_hash):
+    def _failure_reason(self, error):
+        reason = error.get('message', "unknown failure")
+        data = error.get('data') or {}
+        if 'erring_channel' in data:
+            reason += " (erring channel %s)" % data['erring_channel']
+        return reason
+
+    def _wait_for_payment(self, payment_hash):
+        # blocks until the node resolves the payment or the timeout passes.
+        # returns the status along with a reason if it didn't complete
         try:
-            l = self.rpc.listsendpays(None, payment_hash)
-            status = l['payments'][0]['status']
-            return status
+            result = self.rpc.waitsendpay(payment_hash, PAYMENT_TIMEOUT)
+            return result['status'], None
+        except RpcError as e:
+            error = e.error if isinstance(e.error, dict) else {}
+            if error.get('code') == WAITSENDPAY_TIMED_OUT:
+                return "pending", ("still pending after %d seconds" %
+                                   PAYMENT_TIMEOUT)
+            return "failed", self._failure_reason(error)
         except:
-            return "error"
+            return "error", "could not wait for payment"
 
     def _send_onion(self, onion, first_hop, assoc_data, shared_secrets):
         label = str(uuid.uuid4())
@@ -57,57 +90,112 @@ class Draw:
 
     ###########################################################################
 
-    def _draw_pixels(self, myid, cltv_final, pixels):
-        invoice, err = Invoice(self.rpc).create_invoice()
+    def _send_next(self, myid, cltv_final):
+        # fits an onion to the start of the first queued range of pixels and
+        # sends it, leaving the rest of the range queued
+        start, end = self.queued[0]
+        invoice, err = self.invoices.get()
         if err:
-            return None, err
+            return err
         onion_creator = Onion(self.rpc, myid, cltv_final, self.dst_node,
-                              invoice, pixels)
+                              invoice, self.pixels[start:end],
+                              route_cache=self.route_cache)
         onion_result = onion_creator.fit_onion()
         if onion_result['status'] != "success":
-            return None, onion_result['msg']
+            self.invoices.discard(invoice)
+            return onion_result['msg']
         fitted_pixels = onion_result['fitted_pixels']
         result, err = self._send_onion(onion_result['onion'],
                                        onion_result['first_hop'],
                                        onion_result['assoc_data'],
                                        onion_result['shared_secrets'])
         if err:
-            return None, err
+            self.route_cache.invalidate()
+            self.invoices.discard(invoice)
+            return err
         if result['status'] not in {"pending", "complete"}:
-            return None, "payment status not as expected after send"
+            self.route_cache.invalidate()
+            self.invoices.discard(invoice)
+            return "payment status not as expected after send"
+        if start + fitted_pixels == end:
+            self.queued.pop(0)
+        else:
+            self.queued[0] = (start + fitted_pixels, end)
+        payment = {'start':        start,
+                   'end':          start + fitted_pixels,
+                   'payment_hash': onion_result['payment_hash']}
+        print("sent pixels %d to %d" % (payment['start'], payment['end']))
         if result['status'] == "complete":
-            return result['fitted_pixels'], None
-        print("waiting for payment completion")
-        checks = 0
-        while True:
-            status = self._payment_status(onion_result['payment_hash'])
-            if status == "complete":
-                break
-            if status != "pending":
-                return None, "payment did not complete. Status: %s" % status
-            checks += 1
-            if checks == WAIT_FOR_PAYMENT_CHECKS:
-                return None, "payment didn't complete"
-            print("(%s) sleeping waiting for payment to complete..." % status)
-            time.sleep(WAIT_FOR_PAYMENT_PERIOD)
-        return onion_result['fitted_pixels'], None
+            self._payment_complete(payment)
+        else:
+            self.in_flight.append(payment)
+        return None
+
+    def _payment_complete(self, payment):
+        print("pixels %d to %d drawn" % (payment['start'], payment['end']))
+        self.pixels_drawn += payment['end'] - payment['start']
+
+    def _requeue(self, payment):
+        bisect.insort(self.queued, (payment['start'], payment['end']))
+
+    def _wait_in_flight(self):
+        # waits on the oldest pending payment, returning an error if the
+        # drawing can't go on. Later payments that resolve meanwhile are
+        # picked up without waiting when their turn comes.
+        payment = self.in_flight.pop(0)
+        status, reason = self._wait_for_payment(payment['payment_hash'])
+        if status == "complete":
+            self._payment_complete(payment)
+            return None
+        if status == "pending":
+            # the outcome is unknown, so the pixels are neither counted as
+            # drawn nor sent again
+            self.unresolved.append(payment)
+            return "payment didn't complete: %s" % reason
+        # the cached route or fees may be what made it fail
+        self.route_cache.invalidate()
+        self._requeue(payment)
+        self.failures += 1
+        print("payment for pixels %d to %d failed: %s" % (payment['start'],
+              payment['end'], reason))
+        if self.failures > MAX_FAILURES:
+            return "payment did not complete: %s" % reason
+        return None
 
     def _draw_loop(self, myid, cltv_final):
-        pixels = self.pixels
+        err = None
         while True:
-            pixels_drawn, err = self._draw_pixels(myid, cltv_final, pixels)
-            if err:
-                return err
-            if pixels_drawn:
-                self.pixels_drawn += pixels_drawn
-                pixels = pixels[pixels_drawn:]
-            if len(pixels) == 0:
-                print("all pixels drawn")
-                return None
+            while (not err and self.queued and
+                   len(self.in_flight) < self.max_in_flight):
+                err = self._send_next(myid, cltv_final)
+            if not self.in_flight:
+                break
+            print("(%d pending) waiting for payment to complete..." %
+                  len(self.in_flight))
+            wait_err = self._wait_in_flight()
+            err = err or wait_err
+        if err:
+            return err
+        print("all pixels drawn")
+        return None
+
+    def _first_undrawn(self):
+        starts = [start for start, _ in self.queued]
+        starts += [p['start'] for p in self.in_flight + self.unresolved]
+        return min(starts) if starts else self.total_pixels
+
+    def _print_route_cache_stats(self):
+        stats = self.route_cache.stats()
+        print("route cache: %d hits, %d misses (%.0f%% hit rate), %d rpc "
+              "calls saved, %d invalidations" % (stats['hits'],
+              stats['misses'], 100.0 * stats['hit_rate'], stats['rpc_saved'],
+              stats['invalidations']))
 
     def _get_report(self):
-        return {"total_pixels": self.total_pixels,
-                "pixels_drawn": self.pixels_drawn}
+        return {"total_pixels":  self.total_pixels,
+                "pixels_drawn":  self.pixels_drawn,
+                "first_undrawn": self._first_undrawn(),
+                "route_cache":   self.route_cache.stats()}
 
     ###########################################################################
 
@@ -119,12 +207,17 @@ class Draw:
         cltv_final = self._get_cltv_final()
         if not cltv_final:
             return self._get_report(), "could not get cltv_final"
+        self.invoices.start()
         try:
             err = self._draw_loop(myid, cltv_final)
+            self._print_route_cache_stats()
             if err:
                 return self._get_report(), err
         except Exception as e:
             import traceback
             print(traceback.format_exc())
-            return self._get_report(), None, "error while buying pixels: %s" % e
+            return self._get_report(), "error while buying pixels: %s" % e
+        finally:
+            deleted = self.invoices.stop()
+            print("deleted %d unused invoices" % deleted)
         return self._get_report(), None
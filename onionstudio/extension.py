@@ -1,13 +1,12 @@
 # Copyright (c) 2020 Jarret Dyrbye
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php
-from bolt.util import h2b
 from bolt.bigsize import BigSize
 from bolt.tlv import Tlv
-from bolt.namespace import Namespace
 from bolt.hop_payload import HopPayload, TlvHopPayload
 
-from onionstudio.pixel import Pixel, PIXEL_BYTE_SIZE
+from onionstudio.pixel import PIXEL_BYTE_SIZE
+from onionstudio.pixel_batch import PixelBatch
 
 # According to BOLT 1, extension TLVs must be greater than 2^16. Odd types
 # allow the TLV to be ignored if it isn't understood.
@@ -15,7 +14,7 @@ PIXEL_TLV_TYPE = 65555
 
 class Extension:
     def _encode_pixels(pixels):
-        encoded = b''.join([p.to_bin() for p in pixels])
+        encoded = PixelBatch.from_pixels(pixels).to_bytes()
         return Tlv(PIXEL_TLV_TYPE, encoded).encode()
 
 
@@ -35,8 +34,8 @@ class Extension:
                      total_msat, pixels):
         unextended = TlvHopPayload.encode_final(amt_to_forward,
                                                 outgoing_cltv_value,
-                                                pament_secret=payment_secret,
-                                                totol_msat= total_msat)
+                                                payment_secret=payment_secret,
+                                                total_msat=total_msat)
         old_len, content, err = BigSize.pop(unextended)
         assert err is None
         pixel_content = Extension._encode_pixels(pixels)
@@ -45,19 +44,36 @@ class Extension:
 
     ###########################################################################
 
+    # lengths of what the encode functions above would produce, see
+    # TlvHopPayload.non_final_len()
+
+    def pixels_tlv_len(n_pixels):
+        return Tlv.encoded_len(PIXEL_TLV_TYPE, n_pixels * PIXEL_BYTE_SIZE)
+
+    def non_final_len(amt_to_forward, outgoing_cltv_value, n_pixels):
+        return TlvHopPayload.non_final_len(
+            amt_to_forward, outgoing_cltv_value,
+            extra_len=Extension.pixels_tlv_len(n_pixels))
+
+    def final_len(amt_to_forward, outgoing_cltv_value, payment_secret,
+                  total_msat, n_pixels):
+        return TlvHopPayload.final_len(
+            amt_to_forward, outgoing_cltv_value, payment_secret=payment_secret,
+            total_msat=total_msat,
+            extra_len=Extension.pixels_tlv_len(n_pixels))
+
+    ###########################################################################
+
     def parse_pixels(tlv):
-        pixels = []
+        # The tlv value is already packed in the Pixel.to_bin() layout and
+        # every 32 bit record decodes to a valid pixel, so the length is the
+        # only thing to check. Callers decode with Pixel.unpack_arrays() or
+        # Pixel.iter_from_bin() if they need more than the packed bytes.
         if tlv.l % PIXEL_BYTE_SIZE != 0:
             return None, "unexpected length"
-        remainder = tlv.v
-        while len(remainder) > 0:
-            pixel_hex, remainder, err = Namespace.pop_bytes(PIXEL_BYTE_SIZE,
-                                                            remainder)
-            if err:
-                return None, err
-            pixels.append(Pixel.from_bin(h2b(pixel_hex)))
         return {'tlv_type_name': "onion_studio_pixels",
-                'pixels':         pixels}, None
+                'n_pixels':       tlv.l // PIXEL_BYTE_SIZE,
+                'pixels_bin':     tlv.v}, None
 
     def parse(byte_string):
         extension_parsers = {PIXEL_TLV_TYPE: Extension.parse_pixels}
@@ -0,0 +1,33 @@
+# Copyright (c) 2020 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+import struct
+
+from onionstudio.pixel import PIXEL_BYTE_SIZE
+
+# |---4 byte magic---|---u32 seq---|---4 byte pixel records ...---|
+#
+# Pixel records are in the Pixel.to_bin() layout. The magic can't be confused
+# with the gzip header that starts a full canvas snapshot.
+DELTA_MAGIC = b"OSD1"
+DELTA_HEADER = struct.Struct(">4sI")
+
+class DeltaFrame:
+    def encode(seq, pixels_bin):
+        assert len(pixels_bin) % PIXEL_BYTE_SIZE == 0
+        return DELTA_HEADER.pack(DELTA_MAGIC, seq & 0xffffffff) + pixels_bin
+
+    def is_delta(frame):
+        return frame[:len(DELTA_MAGIC)] == DELTA_MAGIC
+
+    def parse(frame):
+        if len(frame) < DELTA_HEADER.size:
+            return None, "frame too short"
+        magic, seq = DELTA_HEADER.unpack_from(frame)
+        if magic != DELTA_MAGIC:
+            return None, "not a delta frame"
+        pixels_bin = frame[DELTA_HEADER.size:]
+        if len(pixels_bin) % PIXEL_BYTE_SIZE != 0:
+            return None, "unexpected length"
+        return {'seq':        seq,
+                'pixels_bin': pixels_bin}, None
@@ -0,0 +1,51 @@
+# Copyright (c) 2020 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+import array
+from collections import deque
+
+from onionstudio.pixel_batch import PixelBatch
+
+
+DEFAULT_HISTORY_BATCHES = 1024
+
+
+class History(object):
+    """
+    Bounded ring of the most recent pixel batches keyed by sequence number,
+    so a reconnecting client can be sent just what it missed. Batches are
+    held as packed Pixel.to_bin() records.
+    """
+    def __init__(self, seq, max_batches=DEFAULT_HISTORY_BATCHES):
+        # base_seq is the state the oldest retained batch was applied on top
+        # of, anything older than that has to be served from a snapshot
+        self.base_seq = seq
+        self.seq = seq
+        self.batches = deque()
+        self.max_batches = max_batches
+
+    def add(self, seq, pixels_bin):
+        assert seq == self.seq + 1, "batches must be added in sequence"
+        self.batches.append((seq, pixels_bin))
+        self.seq = seq
+        while len(self.batches) > self.max_batches:
+            self.base_seq, _ = self.batches.popleft()
+
+    def covers(self, seq):
+        return self.base_seq <= seq <= self.seq
+
+    def since(self, seq):
+        """ returns the packed pixels applied after seq merged so only the
+            latest write to each coordinate remains, or None if seq is not
+            covered by the ring. """
+        if not self.covers(seq):
+            return None
+        merged = {}
+        for batch_seq, pixels_bin in self.batches:
+            if batch_seq <= seq:
+                continue
+            for val in PixelBatch.from_bin(pixels_bin).vals:
+                index = val >> 12
+                merged.pop(index, None)
+                merged[index] = val
+        return PixelBatch(array.array("I", merged.values())).to_bytes()
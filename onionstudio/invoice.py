@@ -2,11 +2,16 @@
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php
 import uuid
+import queue
+import threading
 
 INVOICE_DESCRIPTION = ("circular payment invoice to deliver Onion Studio "
                        "extension payload")
 SELF_PAYMENT = 1000 # in millisatoshis
 
+POOL_PUT_PERIOD = 0.1 # seconds between checks for the pool being stopped
+POOL_GET_TIMEOUT = 60 # seconds
+
 class Invoice:
     def __init__(self, rpc):
         self.rpc = rpc
@@ -15,17 +20,108 @@ class Invoice:
         decoded = self.rpc.decodepay(bolt11)
         return decoded['payment_secret']
 
-    def create_invoice(self):
+    def new_invoice(self):
+        """ creates the invoice without printing it. Newer nodes include the
+            payment secret in the result, saving the decodepay call. """
         try:
             msatoshi = SELF_PAYMENT
             label = str(uuid.uuid4())
             description = INVOICE_DESCRIPTION
             invoice = self.rpc.invoice(msatoshi, label, description)
-            invoice['payment_secret'] = self._get_payment_secret(
-                invoice['bolt11'])
-            print("bolt11: %s" % invoice['bolt11'])
-            print("payment_secret: %s" % invoice['payment_secret'])
-            print("payment_hash: %s" % invoice['payment_hash'])
+            invoice['label'] = label
+            if 'payment_secret' not in invoice:
+                invoice['payment_secret'] = self._get_payment_secret(
+                    invoice['bolt11'])
             return invoice, None
         except:
             return None, "could not create invoice"
+
+    def print_invoice(invoice):
+        print("bolt11: %s" % invoice['bolt11'])
+        print("payment_secret: %s" % invoice['payment_secret'])
+        print("payment_hash: %s" % invoice['payment_hash'])
+
+    def create_invoice(self):
+        invoice, err = self.new_invoice()
+        if err:
+            return None, err
+        Invoice.print_invoice(invoice)
+        return invoice, None
+
+
+class InvoicePool:
+    """
+    Creates invoices on a background thread ahead of when they are needed, so
+    a drawing doesn't wait on the invoice and decodepay calls before finding
+    a route for each onion. Up to size invoices are kept ready. Those still
+    unused when the pool is stopped are deleted from the node.
+    """
+    def __init__(self, rpc, size):
+        self.rpc = rpc
+        self.ready = queue.Queue(maxsize=max(1, size))
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._fill, daemon=True)
+        self.err = None
+
+    def _put(self, item):
+        while not self.stopping.is_set():
+            try:
+                self.ready.put(item, timeout=POOL_PUT_PERIOD)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _fill(self):
+        while not self.stopping.is_set():
+            invoice, err = Invoice(self.rpc).new_invoice()
+            if not self._put((invoice, err)):
+                if invoice:
+                    self._delete(invoice)
+                return
+            if err:
+                return
+
+    def _delete(self, invoice):
+        try:
+            self.rpc.delinvoice(invoice['label'], "unpaid")
+            return True
+        except:
+            return False
+
+    ###########################################################################
+
+    def start(self):
+        self.thread.start()
+
+    def get(self):
+        if self.err:
+            return None, self.err
+        try:
+            invoice, err = self.ready.get(timeout=POOL_GET_TIMEOUT)
+        except queue.Empty:
+            return None, "timed out waiting for an invoice"
+        if err:
+            self.err = err
+            return None, err
+        Invoice.print_invoice(invoice)
+        return invoice, None
+
+    def discard(self, invoice):
+        """ deletes an invoice taken with get() that won't be paid """
+        return self._delete(invoice)
+
+    def stop(self):
+        """ stops making invoices and deletes the unused ones, returning how
+            many were deleted """
+        self.stopping.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        deleted = 0
+        while True:
+            try:
+                invoice, _ = self.ready.get_nowait()
+            except queue.Empty:
+                return deleted
+            if invoice and self._delete(invoice):
+                deleted += 1
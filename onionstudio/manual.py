@@ -3,6 +3,7 @@
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php
 import sys
 from onionstudio.pixel import Pixel
+from onionstudio.pixel_batch import PixelBatch
 
 class ManualToPixels:
     def __init__(self, pixels_string):
@@ -14,7 +15,7 @@ class ManualToPixels:
             return None, "no pixels given"
         if len(string_tokens) % 3 != 0:
             return None, 'could not parse "%s" as pixels' % self.pixels_string
-        pixels = []
+        pixels = PixelBatch()
         for i in range(0, len(string_tokens), 3):
             pixel_tokens = string_tokens[i:i+3]
             try:
@@ -1,7 +1,6 @@
 # Copyright (c) 2020 Jarret Dyrbye
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php
-import math
 import pprint
 
 from pyln.client import Millisatoshi
@@ -9,6 +8,7 @@ from pyln.client import Millisatoshi
 from onionstudio.pixel import PIXEL_BYTE_SIZE
 from onionstudio.extension import Extension
 from onionstudio.invoice import SELF_PAYMENT
+from onionstudio.route_cache import RouteCache
 
 from bolt.util import h2b
 from bolt.hop_payload import LegacyHopPayload, TlvHopPayload
@@ -17,21 +17,22 @@ from bolt.hop_payload import LegacyHopPayload, TlvHopPayload
 RISK_FACTOR = 10
 CLTV_FINAL_PAD = 3
 ONION_SIZE = 1300
-INITIAL_HOP_GUESS = 4
+HMAC_SIZE = 32
 MAX_HOPS = 8
 
-FIT_ONION_TRIES = 20
-
 EXCLUDE = []
 
 class Onion:
     def __init__(self, rpc, myid, cltv_final, dst_node, invoice,
-                 available_pixels):
+                 available_pixels, route_cache=None):
         """
         Finds a valid onion to route to the destination node that fits as many
-        pixels as possible with appropriate payment
+        pixels as possible with appropriate payment. Routes and channel
+        policies come from route_cache, which can be shared between onions.
         """
         self.rpc = rpc
+        self.route_cache = (RouteCache(rpc) if route_cache is None else
+                            route_cache)
         self.myid = myid
         self.dst_node = dst_node
         self.invoice = invoice
@@ -45,41 +46,6 @@ class Onion:
 
     ###########################################################################
 
-    def _estimate_routing_bytes(self, n_hops):
-        # WARNING - this is a fudge, variable sizes can't easily be anticpated
-        # hard to estmiate due to variable encoding
-        #
-        # Perhaps more exact knowledge of the onion packet's construction in
-        # BOLT 4 could be better encoded here.
-        #
-        # legacy payloads == 33 bytes + 32 byte hmac
-        # tlv mid payloads ~= 18 bytes + 32 byte hmac
-        # tlv final payloads ~= 46 bytes + 32 byte hmac
-        if n_hops == 1:
-            # destination is only hop
-            return 46 + 32
-        # assume along circular route, target mid hops and self is tlv
-        # the rest are legacy
-        est = 0
-        # end tlv hop
-        est += 46 + 32
-        # target mid hop
-        est += 21 + 32
-        # other hops - assume legacy since those are going to be bigger
-        est += (33 + 32) * (n_hops - 2)
-        return est
-
-    def _estimate_payload_pixels(self, n_hops):
-        print("estimating for %d hops" % n_hops)
-        print("routing bytes: %d" % self._estimate_routing_bytes(n_hops))
-        approx_bytes = ONION_SIZE - self._estimate_routing_bytes(n_hops)
-        print("bytes for payload: %d" % approx_bytes)
-        approx_pixels = math.floor(approx_bytes / PIXEL_BYTE_SIZE)
-        print("pixels payload: %d" % approx_pixels)
-        return approx_pixels
-
-    ###########################################################################
-
     def _get_block_height(self):
         try:
             info = self.rpc.getinfo()
@@ -92,34 +58,45 @@ class Onion:
 
     def _get_outgoing_route(self, dst_payment):
         try:
-            r = self.rpc.getroute(self.dst_node, SELF_PAYMENT + dst_payment,
-                                  RISK_FACTOR, fuzzpercent=0.0,
-                                  maxhops=MAX_HOPS, exclude=EXCLUDE)
+            r = self.route_cache.getroute(self.dst_node,
+                                          SELF_PAYMENT + dst_payment,
+                                          RISK_FACTOR, fuzzpercent=0.0,
+                                          maxhops=MAX_HOPS, exclude=EXCLUDE)
             return r, None
         except:
             return None, "could not find route to %s" % (self.dst_node)
 
     def _get_returning_route(self, myid):
         try:
-            r = self.rpc.getroute(myid, SELF_PAYMENT, RISK_FACTOR,
-                                  fromid=self.dst_node, fuzzpercent=0.0,
-                                  maxhops=MAX_HOPS, exclude=EXCLUDE)
+            r = self.route_cache.getroute(myid, SELF_PAYMENT, RISK_FACTOR,
+                                          fromid=self.dst_node,
+                                          fuzzpercent=0.0, maxhops=MAX_HOPS,
+                                          exclude=EXCLUDE)
             return r, None
         except:
             return None, "could not find route from %s to %s" % (self.dst_node,
                                                                  myid)
 
-    def _rework_routing_fees(self, route, pay_dst, pay_msat):
+    def _get_channel_policies(self, route):
+        # the fee policy of the channel leading into each hop, looked up once
+        # per route so fees can be reworked for different amounts
+        policies = []
+        for r in route:
+            try:
+                ch = self.route_cache.channel_policy(r['channel'], r['id'])
+            except:
+                return None, "could not get channel %s" % r['channel']
+            policies.append(ch)
+        return policies, None
+
+    def _rework_routing_fees(self, route, policies, pay_dst, pay_msat):
         # Thanks to sendinvoiceless.py plugin for this logic!
         delay = self.cltv_final + CLTV_FINAL_PAD
         msatoshi = Millisatoshi(SELF_PAYMENT)
-        for r in reversed(route):
+        for r, ch in reversed(list(zip(route, policies))):
             r['msatoshi'] = msatoshi.millisatoshis
             r['amount_msat'] = msatoshi
             r['delay'] = delay
-            channels = self.rpc.listchannels(r['channel'])
-            ch = next(c for c in channels.get('channels') if
-                      c['destination'] == r['id'])
             fee = Millisatoshi(ch['base_fee_millisatoshi'])
             # BOLT #7 requires fee >= fee_base_msat + ( amount_to_forward *
             # fee_proportional_millionths / 1000000 )
@@ -131,12 +108,7 @@ class Onion:
             delay += ch['delay']
             r['direction'] = int(ch['channel_flags']) % 2
 
-    def _assemble_circular(self, outgoing, returning, dst_payment):
-        circular = outgoing['route'] + returning['route']
-        self._rework_routing_fees(circular, self.dst_node, dst_payment)
-        return circular
-
-    def _get_circular(self, hop_count, pixel_underestimate, dst_payment):
+    def _get_circular(self, dst_payment):
         outgoing, err = self._get_outgoing_route(dst_payment)
         if err:
             return {'status': "err", 'msg': err}
@@ -147,17 +119,13 @@ class Onion:
             return {'status': "err", 'msg': err}
         print("found returning route back to ourselves:")
         self.print_dict(returning)
-        needed_hops = len(outgoing['route']) + len(returning['route'])
-        if needed_hops != hop_count:
-            print("different hop count than expected, need to recalculate...")
-            return {'status':              "recalculate",
-                    "needed_hops":         needed_hops,
-                    "pixel_underestimate": pixel_underestimate}
-        circular = self._assemble_circular(outgoing, returning, dst_payment)
-        print("assembled circular route:")
-        self.print_dict(circular)
+        circular = outgoing['route'] + returning['route']
+        policies, err = self._get_channel_policies(circular)
+        if err:
+            return {'status': "err", 'msg': err}
         return {'status':   "success",
-                "circular": circular}
+                "circular": circular,
+                "policies": policies}
 
     ###########################################################################
 
@@ -176,7 +144,7 @@ class Onion:
     def _encode_final(self, pubkey, channel, msatoshi, block_height, delay,
                       payment_secret, pixels):
         if pubkey == self.dst_node:
-            p = Extension.encode_final(msatoshi, block_height + delay, channel,
+            p = Extension.encode_final(msatoshi, block_height + delay,
                                        payment_secret, msatoshi, pixels)
         else:
             p = TlvHopPayload.encode_final(msatoshi, block_height + delay,
@@ -192,27 +160,78 @@ class Onion:
                 'pubkey':  pubkey,
                 'payload': p.hex()}
 
-    def _iter_hops(self, circular, block_height, payment_secret, pixels):
+    def _iter_hop_args(self, circular):
+        # yields (src, dst, final) for each payload in the onion, where the
+        # payload for src's node carries dst's channel, amount and delay
         for i in range(len(circular) - 1):
-            src = circular[i]
-            dst = circular[i + 1]
+            yield circular[i], circular[i + 1], False
+        yield circular[-1], circular[-1], True
+
+    def _iter_hops(self, circular, block_height, payment_secret, pixels):
+        for src, dst, final in self._iter_hop_args(circular):
             if src['style'] == 'legacy':
                 yield self._encode_legacy(src['id'], dst['channel'],
                                           dst['msatoshi'], block_height,
                                           dst['delay'])
-            else:
+            elif not final:
                 yield self._encode_non_final(src['id'], dst['channel'],
                                              dst['msatoshi'], block_height,
                                              dst['delay'], pixels)
-        dst = circular[-1]
-        if dst['style'] == 'legacy':
-            yield self._encode_legacy(dst['id'], dst['channel'],
-                                      dst['msatoshi'], block_height,
-                                      dst['delay'])
-        else:
-            yield self._encode_final(dst['id'], dst['channel'],
-                                     dst['msatoshi'], block_height,
-                                     dst['delay'], payment_secret, pixels)
+            else:
+                yield self._encode_final(dst['id'], dst['channel'],
+                                         dst['msatoshi'], block_height,
+                                         dst['delay'], payment_secret, pixels)
+
+    def _hop_payload_len(self, src, dst, final, block_height, payment_secret,
+                         n_pixels):
+        # mirrors _iter_hops() and the _encode_*() functions without encoding
+        # anything
+        if src['style'] == 'legacy':
+            return LegacyHopPayload.encoded_len()
+        cltv = block_height + dst['delay']
+        if not final and src['id'] == self.dst_node:
+            return Extension.non_final_len(dst['msatoshi'], cltv, n_pixels)
+        if not final:
+            return TlvHopPayload.non_final_len(dst['msatoshi'], cltv)
+        if dst['id'] == self.dst_node:
+            return Extension.final_len(dst['msatoshi'], cltv, payment_secret,
+                                       dst['msatoshi'], n_pixels)
+        return TlvHopPayload.final_len(dst['msatoshi'], cltv,
+                                       payment_secret=payment_secret,
+                                       total_msat=dst['msatoshi'])
+
+    def _onion_bytes(self, circular, policies, block_height, n_pixels):
+        # exact onion payload usage for n_pixels. Fees and so the tu64
+        # amounts depend on the pixel count, so they are reworked first.
+        self._rework_routing_fees(circular, policies, self.dst_node,
+                                  1000 * n_pixels)
+        return sum(self._hop_payload_len(src, dst, final, block_height,
+                                         self.payment_secret, n_pixels) +
+                   HMAC_SIZE for src, dst, final in
+                   self._iter_hop_args(circular))
+
+    def _carries_pixels(self, circular):
+        # pixels only go in a tlv payload for the destination node's hop
+        return any(src['style'] != 'legacy' and
+                   (dst if final else src)['id'] == self.dst_node for
+                   src, dst, final in self._iter_hop_args(circular))
+
+    def _max_fitting_pixels(self, circular, policies, block_height,
+                            max_pixels):
+        # more pixels never makes any payload smaller, so binary search for
+        # the largest count that fits
+        if self._onion_bytes(circular, policies, block_height, 0) > ONION_SIZE:
+            return 0
+        low = 0
+        high = max_pixels
+        while low < high:
+            mid = (low + high + 1) // 2
+            if (self._onion_bytes(circular, policies, block_height, mid) <=
+                    ONION_SIZE):
+                low = mid
+            else:
+                high = mid - 1
+        return low
 
     def _assemble_hops(self, circular, block_height, payment_secret, pixels):
         return list(self._iter_hops(circular, block_height, payment_secret,
@@ -222,66 +241,67 @@ class Onion:
         total = 0
         for hop in hops:
             payload_len = len(h2b(hop['payload']))
-            hmac_len = 32 # include hmac byytes needed when packed in onion
+            hmac_len = HMAC_SIZE # hmac bytes needed when packed in onion
             total += payload_len + hmac_len
         return total
 
-    def _get_hops(self, hop_count, pixel_underestimate, dst_payment,
-                  attempting_pixel_list):
-        result = self._get_circular(hop_count, pixel_underestimate, dst_payment)
-        if result['status'] in {'recalculate', 'err'}:
+    ###########################################################################
+
+    def _create_onion(self, hops, assocdata):
+        try:
+            result = self.rpc.createonion(hops, assocdata)
+            return result['onion'], result['shared_secrets'], None
+        except:
+            return None, None, "could not create onion"
+
+    ###########################################################################
+
+    def fit_onion(self):
+        # Routes are looked up once for the most pixels that could possibly
+        # fit, which is also the largest amount. The pixel count that
+        # actually fits is then calculated exactly over that route, and a
+        # route good for the larger amount is good for the smaller one.
+        max_pixels = min(len(self.available_pixels),
+                         ONION_SIZE // PIXEL_BYTE_SIZE)
+        result = self._get_circular(1000 * max_pixels)
+        if result['status'] == 'err':
             return result
         circular = result['circular']
+        policies = result['policies']
+
+        if not self._carries_pixels(circular):
+            return {'status': "err",
+                    'msg':    "route has no tlv payload for the destination "
+                              "to carry pixels"}
 
         block_height = self._get_block_height()
         if not block_height:
             return {'status': "err", 'msg': "could not get block height"}
 
+        n_pixels = self._max_fitting_pixels(circular, policies, block_height,
+                                            max_pixels)
+        if n_pixels == 0:
+            return {'status': "err",
+                    'msg':    "no room for pixels in an onion along a %d hop "
+                              "route" % len(circular)}
+        onion_bytes = self._onion_bytes(circular, policies, block_height,
+                                        n_pixels)
+        print("fitting %d pixels using %d of %d onion bytes" % (
+              n_pixels, onion_bytes, ONION_SIZE))
+        print("assembled circular route:")
+        self.print_dict(circular)
+
+        pixels = self.available_pixels[:n_pixels]
         hops = self._assemble_hops(circular, block_height, self.payment_secret,
-                                   attempting_pixel_list)
+                                   pixels)
         print("generated hops:")
         self.print_dict(hops)
-        sum_payload_sizes = self._sum_payload_sizes(hops)
-        print("sum payload sizes: %s" % sum_payload_sizes)
-        print("hops: %s" % len(hops))
-        if self._sum_payload_sizes(hops) > ONION_SIZE:
-            print("payloads are too big, retrying with less pixels")
-            return {'status':              "recalculate",
-                    "needed_hops":         len(hops),
-                    "pixel_underestimate": pixel_underestimate + 3}
-        return {'status':    'success',
-                'hops':      hops,
-                'first_hop': circular[0]}
-
-
-    ###########################################################################
-
-    def _slice_pixels(self, hop_count, pixel_underestimate):
-        will_fit = self._estimate_payload_pixels(hop_count)
-        print("it's estimated that %d pixels will fit" % will_fit)
-        attempting_pixels = (min(will_fit, len(self.available_pixels)) -
-                             pixel_underestimate)
-        print("attempting to fit %d pixels" % attempting_pixels)
-        dst_payment = 1000 * attempting_pixels
-        print("attempting onion that pays the destination %dmsat" % dst_payment)
-        pixels = self.available_pixels[:attempting_pixels]
-        return dst_payment, pixels
-
-    def _create_onion(self, hops, assocdata):
-        try:
-            result = self.rpc.createonion(hops, assocdata)
-            return result['onion'], result['shared_secrets'], None
-        except:
-            return None, None, "could not create onion"
+        if self._sum_payload_sizes(hops) != onion_bytes:
+            return {'status': "err",
+                    'msg':    "calculated onion size %d does not match "
+                              "encoded size %d" % (
+                                  onion_bytes, self._sum_payload_sizes(hops))}
 
-    def _fit_attempt(self, hop_count, pixel_underestimate):
-        dst_payment, pixels = self._slice_pixels(hop_count, pixel_underestimate)
-        result = self._get_hops(hop_count, pixel_underestimate, dst_payment,
-                                pixels)
-        if result['status'] in {'recalculate', 'err'}:
-            return result
-        hops = result['hops']
-        first_hop = result['first_hop']
         onion, shared_secrets, err = self._create_onion(hops, self.payment_hash)
         if err:
             return {'status': "err",
@@ -290,27 +310,8 @@ class Onion:
         print("shared_secrets: %s" % str(shared_secrets))
         return {'status':         "success",
                 'onion':          onion,
-                'first_hop':      first_hop,
+                'first_hop':      circular[0],
                 'assoc_data':     self.invoice['payment_hash'],
                 'payment_hash':   self.invoice['payment_hash'],
                 'shared_secrets': shared_secrets,
-                'fitted_pixels':  len(pixels)}
-
-    ###########################################################################
-
-    def fit_onion(self):
-        hop_count = INITIAL_HOP_GUESS
-        pixel_underestimate = 0
-        retry_count = 0
-        while retry_count < FIT_ONION_TRIES:
-            result = self._fit_attempt(hop_count, pixel_underestimate)
-            if result['status'] == "success":
-                return result
-            elif result['status'] == "recalculate":
-                retry_count += 1
-                hop_count = result['needed_hops']
-                pixel_underestimate = result['pixel_underestimate']
-            elif result['status'] == 'err':
-                return result
-        return {'status': "err",
-                'msg': "could not fit onion after %d tries" % FIT_ONION_TRIES}
+                'fitted_pixels':  n_pixels}
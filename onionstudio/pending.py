@@ -0,0 +1,264 @@
+# Copyright (c) 2020 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+import os
+import time
+import heapq
+from collections import OrderedDict
+
+from bolt.util import h2b
+
+from onionstudio.update_log import UpdateLog
+from onionstudio.update_log import DEFAULT_SYNC_RECORDS, DEFAULT_SYNC_MS
+
+# the store isn't compacted until it holds at least this many records
+PENDING_COMPACT_RECORDS = 1024
+
+
+class PendingHtlcs(object):
+    """
+    Accepted HTLCs waiting on their settlement, keyed by payment hash. A
+    min-heap ordered by receive time sits alongside the dict so expiring old
+    entries only touches the ones that are actually expired.
+
+    If given a PendingStore, additions and settlements are also written there
+    so the table can be reloaded after a restart.
+    """
+    def __init__(self, expire_seconds, store=None):
+        self.expire_seconds = expire_seconds
+        self.store = store
+        self.htlcs = {}
+        self.expiry = []
+        self.evicted = 0
+        self.last_expire = time.time()
+        self.last_evicted = 0
+        self.last_rate = 0.0
+
+    def __len__(self):
+        return len(self.htlcs)
+
+    def __contains__(self, payment_hash):
+        return payment_hash in self.htlcs
+
+    def restore(self, payment_hash, htlc):
+        self.htlcs[payment_hash] = htlc
+        heapq.heappush(self.expiry, (htlc['recv_time'], payment_hash))
+
+    def add(self, payment_hash, htlc):
+        self.restore(payment_hash, htlc)
+        if self.store:
+            self.store.added(payment_hash, htlc)
+
+    def pop(self, payment_hash):
+        # the heap entry is left behind and skipped once it comes due
+        return self.htlcs.pop(payment_hash, None)
+
+    def settled(self, payment_hash):
+        # called once the pixels of a popped htlc are in the update log, so
+        # the stored entry is only dropped after that
+        if self.store:
+            self.store.removed(payment_hash)
+
+    def expire(self, now=None):
+        now = time.time() if now is None else now
+        cutoff = now - self.expire_seconds
+        evicted = 0
+        while len(self.expiry) > 0 and self.expiry[0][0] <= cutoff:
+            recv_time, payment_hash = heapq.heappop(self.expiry)
+            htlc = self.htlcs.get(payment_hash)
+            # settled already, or re-added later with a newer time
+            if htlc is None or htlc['recv_time'] != recv_time:
+                continue
+            del self.htlcs[payment_hash]
+            evicted += 1
+        self.evicted += evicted
+        if self.store:
+            # expired entries need no record, they are dropped on reload
+            self.store.maybe_compact(self.htlcs)
+        elapsed = now - self.last_expire
+        self.last_rate = (evicted / elapsed) if elapsed > 0 else 0.0
+        self.last_expire = now
+        self.last_evicted = evicted
+        return evicted
+
+    def stats(self):
+        return {'pending':         len(self.htlcs),
+                'heap_entries':    len(self.expiry),
+                'evicted':         self.evicted,
+                'last_evicted':    self.last_evicted,
+                'evicted_per_sec': self.last_rate}
+
+
+class PendingStore(object):
+    """
+    On-disk copy of the pending HTLC table, written as an UpdateLog so it
+    gets the same group commit. An added HTLC is a record holding its receive
+    time and payload, a removal is a record for the same payment hash with an
+    empty payload. The file is rewritten with just the live entries on load
+    and whenever dead records outnumber them.
+
+    Removals are held in memory until write_removals() is called, which the
+    caller does only once the update log holding the settled pixels has been
+    synced. A crash can then lose a removal, leaving an entry that just
+    expires after reload, but never keep a removal whose pixels were lost.
+    """
+    def __init__(self, path, sync_records=DEFAULT_SYNC_RECORDS,
+                 sync_ms=DEFAULT_SYNC_MS):
+        self.path = path
+        self.sync_records = sync_records
+        self.sync_ms = sync_ms
+        self.log = None
+        self.records = 0
+        self.removals = []
+
+    def load(self, expire_seconds, now=None):
+        """ returns (payment_hash, recv_time, payload) for each entry that
+            was pending and has not expired, then compacts the file. """
+        now = time.time() if now is None else now
+        live = OrderedDict()
+        for _, timestamp, payment_hash, payload in UpdateLog.iter_records(
+                self.path):
+            if len(payload) == 0:
+                live.pop(payment_hash, None)
+            else:
+                live[payment_hash] = (timestamp, payload)
+        entries = [(payment_hash.hex(), recv_time, payload) for
+                   payment_hash, (recv_time, payload) in live.items() if
+                   (now - recv_time) < expire_seconds]
+        self.rewrite((payment_hash, recv_time, payload) for
+                     payment_hash, recv_time, payload in entries)
+        return entries
+
+    def rewrite(self, entries):
+        # write-then-rename so a crash leaves the old or the new file whole
+        if self.log:
+            self.log.close()
+        tmp_path = self.path + ".tmp"
+        records = 0
+        with open(tmp_path, "wb") as f:
+            for payment_hash, recv_time, payload in entries:
+                f.write(UpdateLog.encode_record(recv_time, h2b(payment_hash),
+                                                payload))
+                records += 1
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.records = records
+        self.log = UpdateLog(self.path, sync_records=self.sync_records,
+                             sync_ms=self.sync_ms)
+
+    ###########################################################################
+
+    def added(self, payment_hash, htlc):
+        self.log.append(h2b(payment_hash), htlc['payload'],
+                        timestamp=htlc['recv_time'])
+        self.records += 1
+
+    def removed(self, payment_hash):
+        self.removals.append(payment_hash)
+
+    def has_removals(self):
+        return len(self.removals) > 0
+
+    def write_removals(self):
+        for payment_hash in self.removals:
+            self.log.append(h2b(payment_hash), b'')
+        self.records += len(self.removals)
+        self.removals = []
+
+    def maybe_compact(self, htlcs):
+        # a rewrite would drop the entries of removals not yet written
+        if self.removals:
+            return
+        if self.records < PENDING_COMPACT_RECORDS:
+            return
+        if self.records < (2 * len(htlcs)):
+            return
+        print("compacting pending htlc store from %d records to %d" % (
+              self.records, len(htlcs)))
+        self.rewrite((payment_hash, htlc['recv_time'], htlc['payload']) for
+                     payment_hash, htlc in htlcs.items())
+
+    def sync(self):
+        self.log.maybe_sync()
+
+    def close(self):
+        self.log.close()
+
+
+class EarlySettlements(object):
+    """
+    Settlements whose forward_event showed up before the matching
+    htlc_accepted. Kept in arrival order so the oldest can be expired or
+    dropped first when the buffer is full.
+
+    Only forwards that could be paying for pixels should be added, ordinary
+    routed payments never get a matching htlc and would only crowd out the
+    real ones. A settlement that gets taken by its htlc is a reorder, the
+    'early' count is just how many were buffered.
+    """
+    def __init__(self, expire_seconds, max_entries):
+        self.expire_seconds = expire_seconds
+        self.max_entries = max_entries
+        self.settled = OrderedDict()
+        self.counts = {'in_order':   0,
+                       'early':      0,
+                       'matched':    0,
+                       'not_pixel':  0,
+                       'discarded':  0,
+                       'expired':    0,
+                       'overflowed': 0}
+
+    def __len__(self):
+        return len(self.settled)
+
+    def add(self, payment_hash, now=None):
+        now = time.time() if now is None else now
+        self.settled.pop(payment_hash, None)
+        self.settled[payment_hash] = now
+        self.counts['early'] += 1
+        while len(self.settled) > self.max_entries:
+            self.settled.popitem(last=False)
+            self.counts['overflowed'] += 1
+
+    def take(self, payment_hash):
+        """ returns True and forgets the settlement if one was buffered """
+        if payment_hash not in self.settled:
+            return False
+        del self.settled[payment_hash]
+        self.counts['matched'] += 1
+        return True
+
+    def discard(self, payment_hash):
+        """ forgets a settlement whose htlc turned out not to carry
+            pixels """
+        if self.settled.pop(payment_hash, None) is not None:
+            self.counts['discarded'] += 1
+
+    def note_in_order(self):
+        self.counts['in_order'] += 1
+
+    def note_not_pixel(self):
+        self.counts['not_pixel'] += 1
+
+    def expire(self, now=None):
+        now = time.time() if now is None else now
+        cutoff = now - self.expire_seconds
+        expired = 0
+        while len(self.settled) > 0:
+            payment_hash, settle_time = next(iter(self.settled.items()))
+            if settle_time > cutoff:
+                break
+            del self.settled[payment_hash]
+            expired += 1
+        self.counts['expired'] += expired
+        return expired
+
+    def stats(self):
+        return {'in_order':   self.counts['in_order'],
+                'reordered':  self.counts['matched'],
+                'buffered':   len(self.settled),
+                'not_pixel':  self.counts['not_pixel'],
+                'discarded':  self.counts['discarded'],
+                'expired':    self.counts['expired'],
+                'overflowed': self.counts['overflowed']}
@@ -1,16 +1,21 @@
 # Copyright (c) 2020 Jarret Dyrbye
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php
+import array
 import string
+import struct
 
 MAX_X = 1024
 MAX_Y = 1024
 
 PIXEL_BYTE_SIZE = 4
+PIXEL_RECORD = struct.Struct(">I")
 
 # |---10 bit x---|---10 bit y---|---12 bit rgb---|
 
 class Pixel(object):
+    __slots__ = ("x", "y", "rgb")
+
     def __init__(self, x, y, rgb):
         assert x < MAX_X
         assert x >= 0
@@ -38,16 +43,37 @@ class Pixel(object):
     def from_bin(pixel_bin):
         #print("bin: %s" % pixel_bin.hex())
         assert len(pixel_bin) == PIXEL_BYTE_SIZE
-        val = int.from_bytes(pixel_bin, byteorder="big")
+        return Pixel.from_val(int.from_bytes(pixel_bin, byteorder="big"))
+
+    def from_val(val):
         x = val >> 22 & 0x03ff
         y = val >> 12 & 0x03ff
         rgb = ("%03x" % (val & 0x0fff))[0:3]
         return Pixel(x, y, rgb)
 
-    def to_bin(self):
+    def unpack_arrays(pixels_bin):
+        """ decodes a string of packed to_bin() records in one pass into
+            parallel arrays of x, y and 12 bit rgb values without creating a
+            Pixel for each """
+        assert len(pixels_bin) % PIXEL_BYTE_SIZE == 0
+        vals = [val for (val,) in PIXEL_RECORD.iter_unpack(pixels_bin)]
+        xs = array.array("H", [val >> 22 for val in vals])
+        ys = array.array("H", [val >> 12 & 0x03ff for val in vals])
+        rgbs = array.array("H", [val & 0x0fff for val in vals])
+        return xs, ys, rgbs
+
+    def iter_from_bin(pixels_bin):
+        """ yields a Pixel for each packed record, for callers that want the
+            objects """
+        xs, ys, rgbs = Pixel.unpack_arrays(pixels_bin)
+        for x, y, rgb in zip(xs, ys, rgbs):
+            yield Pixel(x, y, "%03x" % rgb)
+
+    def to_val(self):
         x_shifted = self.x << 22
         y_shifted = self.y << 12
         rgb_int =  int("0" + self.rgb, 16)
-        val = x_shifted | y_shifted | rgb_int
-        rgb_bin = bytearray.fromhex("0" + self.rgb)
-        return val.to_bytes(4, byteorder="big")
+        return x_shifted | y_shifted | rgb_int
+
+    def to_bin(self):
+        return self.to_val().to_bytes(4, byteorder="big")
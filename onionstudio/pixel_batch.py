@@ -0,0 +1,74 @@
+# Copyright (c) 2020 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+import sys
+import array
+
+from onionstudio.pixel import Pixel, PIXEL_BYTE_SIZE
+
+# values are kept in native byte order and swapped when going to or from the
+# big endian wire format
+SWAP_BYTES = sys.byteorder == "little"
+
+assert array.array("I").itemsize == PIXEL_BYTE_SIZE
+
+
+class PixelBatch(object):
+    """
+    A sequence of pixels held as one array of 32 bit values in the
+    Pixel.to_bin() layout rather than as a list of Pixel objects. Indexing
+    and iterating build a Pixel on the way out, slicing gives another
+    PixelBatch sharing nothing with this one, and to_bytes() gives the packed
+    records as they go in a pixel TLV.
+    """
+    __slots__ = ("vals",)
+
+    def __init__(self, vals=None):
+        self.vals = array.array("I") if vals is None else vals
+
+    def from_bin(pixels_bin):
+        assert len(pixels_bin) % PIXEL_BYTE_SIZE == 0, "not whole pixels"
+        vals = array.array("I")
+        vals.frombytes(pixels_bin)
+        if SWAP_BYTES:
+            vals.byteswap()
+        return PixelBatch(vals)
+
+    def from_pixels(pixels):
+        """ packs an iterable of Pixel objects, or passes a PixelBatch
+            through as it is """
+        if isinstance(pixels, PixelBatch):
+            return pixels
+        return PixelBatch(array.array("I", (p.to_val() for p in pixels)))
+
+    ###########################################################################
+
+    def append(self, pixel):
+        self.vals.append(pixel.to_val())
+
+    def append_val(self, val):
+        self.vals.append(val)
+
+    def __len__(self):
+        return len(self.vals)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return PixelBatch(self.vals[key])
+        return Pixel.from_val(self.vals[key])
+
+    def __iter__(self):
+        for val in self.vals:
+            yield Pixel.from_val(val)
+
+    def __eq__(self, other):
+        return isinstance(other, PixelBatch) and self.vals == other.vals
+
+    ###########################################################################
+
+    def to_bytes(self):
+        if not SWAP_BYTES:
+            return self.vals.tobytes()
+        swapped = array.array("I", self.vals)
+        swapped.byteswap()
+        return swapped.tobytes()
@@ -1,18 +1,22 @@
 # Copyright (c) 2020 Jarret Dyrbye
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php
-from onionstudio.pixel import Pixel
+import array
+
+from onionstudio.pixel_batch import PixelBatch
 
 class PngToPixels:
     def __init__(self, png_file):
         from PIL import Image
         self.img = Image.open(png_file)
 
-    def iter_at_offset(self, x_offset, y_offset):
+    def _iter_vals(self, x_offset, y_offset):
+        # yields each drawn pixel as a packed Pixel.to_bin() value, the rgb
+        # clamped to 12 bits by keeping the high nibble of each channel the
+        # same way Pixel.clamp_rgb() does
         width, height = self.img.size
         rgb_raw = self.img.convert("RGBA")
         px_data = list(rgb_raw.getdata())
-        pixels = []
         for h in range(height):
             for w in range(width):
                 x = w + x_offset
@@ -21,15 +25,50 @@ class PngToPixels:
                 y = h + y_offset
                 if y >= 1024:
                     continue
-                y = h + y_offset
                 idx = (h * width) + w
-                r = px_data[idx][0]
-                g = px_data[idx][1]
-                b = px_data[idx][2]
-                a = px_data[idx][3]
+                r, g, b, a = px_data[idx]
                 # drop mostly transparent pixels
                 if (a < 128):
                     continue
-                #print("r g b a: %d %d %d %d" % (r,g,b,a))
-                rgb = "%02x%02x%02x" % (r, g, b)
-                yield Pixel(x, y, rgb)
+                assert x >= 0 and y >= 0, "negative offset"
+                rgb = ((r >> 4) << 8) | ((g >> 4) << 4) | (b >> 4)
+                yield (x << 22) | (y << 12) | rgb
+
+    def _numpy_vals(self, numpy, x_offset, y_offset):
+        # Same as _iter_vals() over the whole RGBA array at once. Rows and
+        # columns past the edge of the canvas are cut off up front and the
+        # boolean mask keeps row-major order, so the output order matches.
+        rgba = numpy.asarray(self.img.convert("RGBA"), dtype=numpy.uint32)
+        rgba = rgba[:max(0, 1024 - y_offset), :max(0, 1024 - x_offset)]
+        height, width, _ = rgba.shape
+        ys = numpy.arange(height, dtype=numpy.int64) + y_offset
+        xs = numpy.arange(width, dtype=numpy.int64) + x_offset
+        drawn = rgba[:, :, 3] >= 128
+        if drawn.any():
+            rows, cols = numpy.nonzero(drawn)
+            assert xs[cols].min() >= 0 and ys[rows].min() >= 0, (
+                "negative offset")
+        xs = numpy.maximum(xs, 0).astype(numpy.uint32)
+        ys = numpy.maximum(ys, 0).astype(numpy.uint32)
+        rgb = (((rgba[:, :, 0] >> 4) << 8) | ((rgba[:, :, 1] >> 4) << 4) |
+               (rgba[:, :, 2] >> 4))
+        vals = ((xs[numpy.newaxis, :] << 22) | (ys[:, numpy.newaxis] << 12) |
+                rgb)
+        return vals[drawn]
+
+    def batch_at_offset(self, x_offset, y_offset):
+        """ returns the drawn pixels as a PixelBatch, vectorized with numpy if
+            it is installed and falling back to a loop over the pixels if
+            not """
+        try:
+            import numpy
+        except ImportError:
+            return PixelBatch(array.array("I", self._iter_vals(x_offset,
+                                                               y_offset)))
+        vals = array.array("I")
+        vals.frombytes(self._numpy_vals(numpy, x_offset, y_offset).astype(
+            numpy.uint32).tobytes())
+        return PixelBatch(vals)
+
+    def iter_at_offset(self, x_offset, y_offset):
+        return iter(self.batch_at_offset(x_offset, y_offset))
@@ -0,0 +1,84 @@
+# Copyright (c) 2020 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+import copy
+import time
+
+ROUTE_CACHE_SECONDS = 600
+
+
+class RouteCache:
+    """
+    Keeps getroute results and channel fee policies for the length of a Draw
+    session, which otherwise repeats the same lookups for every onion while
+    the graph barely changes. Entries expire after ttl seconds and the
+    whole cache is dropped when a payment fails, since a stale route or fee
+    is the most likely cause.
+
+    A route looked up for an amount is reused for the same or a smaller
+    amount between the same nodes.
+    """
+    def __init__(self, rpc, ttl=ROUTE_CACHE_SECONDS):
+        self.rpc = rpc
+        self.ttl = ttl
+        self.routes = {}
+        self.channels = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _fresh(self, entry):
+        return (time.time() - entry['time']) < self.ttl
+
+    ###########################################################################
+
+    def getroute(self, node_id, msatoshi, riskfactor, fromid=None, **kwargs):
+        """ same arguments as the getroute RPC. Returns a copy the caller is
+            free to modify. """
+        key = (fromid, node_id, riskfactor, repr(sorted(kwargs.items())))
+        entry = self.routes.get(key)
+        if entry and self._fresh(entry) and msatoshi <= entry['msatoshi']:
+            self.hits += 1
+            return copy.deepcopy(entry['result'])
+        self.misses += 1
+        if fromid is None:
+            result = self.rpc.getroute(node_id, msatoshi, riskfactor, **kwargs)
+        else:
+            result = self.rpc.getroute(node_id, msatoshi, riskfactor,
+                                       fromid=fromid, **kwargs)
+        self.routes[key] = {'time':     time.time(),
+                            'msatoshi': msatoshi,
+                            'result':   copy.deepcopy(result)}
+        return result
+
+    def channel_policy(self, short_channel_id, destination):
+        """ returns the listchannels entry for the direction of the channel
+            leading to destination. Raises if it isn't found, like the
+            lookup it replaces. """
+        key = (short_channel_id, destination)
+        entry = self.channels.get(key)
+        if entry and self._fresh(entry):
+            self.hits += 1
+            return entry['policy']
+        self.misses += 1
+        channels = self.rpc.listchannels(short_channel_id)
+        policy = next(c for c in channels.get('channels') if
+                      c['destination'] == destination)
+        self.channels[key] = {'time':   time.time(),
+                              'policy': policy}
+        return policy
+
+    def invalidate(self):
+        self.routes = {}
+        self.channels = {}
+        self.invalidations += 1
+
+    ###########################################################################
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits':          self.hits,
+                'misses':        self.misses,
+                'hit_rate':      (self.hits / lookups) if lookups else 0.0,
+                'rpc_saved':     self.hits,
+                'invalidations': self.invalidations}
@@ -0,0 +1,104 @@
+# Copyright (c) 2020 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+from twisted.internet import reactor, threads
+
+from onionstudio.art_db import ArtDb, N_TILES
+from onionstudio.compressor import chunk_compressor, assemble_chunks
+
+RETRY_SECONDS = 1
+MAX_RETRY_SECONDS = 60
+
+
+class Snapshot(object):
+    """
+    Keeps one compressed copy of the canvas for sending to newly connected
+    clients. It is only rebuilt when a client asks for it after the ArtDb
+    sequence number has moved on, and the compression runs in the reactor's
+    thread pool. Every client asking while a build is in flight is handed the
+    same bytes when it finishes.
+
+    Each tile is compressed on its own and kept, so a rebuild only
+    recompresses the tiles ArtDb has marked dirty since the previous build.
+    Builds are run one at a time since they share the per-tile blobs. A
+    failed build is retried with a doubling delay rather than handing out an
+    older snapshot, which would be missing updates the waiting clients were
+    never sent.
+    """
+    def __init__(self, art_db):
+        self.art_db = art_db
+        self.tile_bytes = ArtDb.tile_bytes()
+        self.tiles = [None] * N_TILES
+        self.seq = None
+        self.compressed = None
+        self.building_seq = None
+        self.building = []
+        self.waiting = []
+        self.retry_seconds = RETRY_SECONDS
+        self.retry_call = None
+
+    def is_current(self):
+        return self.seq == self.art_db.seq
+
+    def get(self, callback):
+        """ calls callback(seq, compressed) with a snapshot that reflects at
+            least the ArtDb state at the time of the call. """
+        if self.is_current():
+            callback(self.seq, self.compressed)
+            return
+        if self.building_seq == self.art_db.seq:
+            self.building.append(callback)
+            return
+        self.waiting.append(callback)
+        if self.building_seq is None and self.retry_call is None:
+            self._build()
+
+    ###########################################################################
+
+    def _compress(self, art_bin, dirty):
+        for tile in dirty:
+            start = tile * self.tile_bytes
+            chunk = art_bin[start:start + self.tile_bytes]
+            self.tiles[tile] = chunk_compressor(chunk)
+        return assemble_chunks(self.tiles, art_bin)
+
+    def _build(self):
+        seq = self.art_db.seq
+        self.building_seq = seq
+        self.building, self.waiting = self.waiting, []
+        # copying the mmap is quick and has to happen on the reactor thread to
+        # get a consistent picture, compressing it is what's slow
+        dirty = self.art_db.take_dirty_tiles()
+        art_bin = self.art_db.to_bin()
+        d = threads.deferToThread(self._compress, art_bin, dirty)
+        d.addCallback(self._built, seq, len(dirty))
+        d.addErrback(self._failed, seq, dirty)
+
+    def _built(self, compressed, seq, n_dirty):
+        print("built snapshot for seq %d recompressing %d of %d tiles, "
+              "compressed len: %d" % (seq, n_dirty, N_TILES, len(compressed)))
+        self.seq = seq
+        self.compressed = compressed
+        self.building_seq = None
+        self.retry_seconds = RETRY_SECONDS
+        callbacks, self.building = self.building, []
+        for callback in callbacks:
+            callback(seq, compressed)
+        if self.waiting:
+            self._build()
+
+    def _failed(self, failure, seq, dirty):
+        print("could not build snapshot for seq %d, retrying in %d seconds "
+              "for %d waiting clients: %s" % (seq, self.retry_seconds,
+              len(self.building) + len(self.waiting), failure))
+        self.art_db.mark_dirty_tiles(dirty)
+        self.building_seq = None
+        self.waiting = self.building + self.waiting
+        self.building = []
+        self.retry_call = reactor.callLater(self.retry_seconds, self._retry)
+        self.retry_seconds = min(self.retry_seconds * 2, MAX_RETRY_SECONDS)
+
+    def _retry(self):
+        self.retry_call = None
+        if self.waiting:
+            self._build()
@@ -0,0 +1,81 @@
+# Copyright (c) 2020 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+from onionstudio.art_db import WIDTH, HEIGHT
+from onionstudio.pixel_batch import PixelBatch
+
+# Subscriptions are tracked on a grid of square tiles. Tile ids run down each
+# column of tiles first, same as pixels do in studio.dat.
+SUB_TILE_SIZE = 64
+SUB_TILES_WIDE = WIDTH // SUB_TILE_SIZE
+SUB_TILES_HIGH = HEIGHT // SUB_TILE_SIZE
+N_SUB_TILES = SUB_TILES_WIDE * SUB_TILES_HIGH
+
+
+class Subscriptions(object):
+    """
+    Spatial index from tiles to the clients displaying them. A client is
+    either subscribed to everything, which is the default, or to a set of
+    tiles. Finding the recipients of an update costs one lookup per tile the
+    update touches rather than a scan over every client.
+    """
+    def __init__(self):
+        self.everything = set()
+        self.by_tile = {}
+        self.client_tiles = {}
+
+    def tile_id(x, y):
+        return ((x // SUB_TILE_SIZE) * SUB_TILES_HIGH) + (y // SUB_TILE_SIZE)
+
+    def tiles_for_rect(x, y, width, height):
+        if width <= 0 or height <= 0:
+            return None, "empty rectangle"
+        if x < 0 or y < 0 or (x + width) > WIDTH or (y + height) > HEIGHT:
+            return None, "rectangle out of bounds"
+        x_tiles = range(x // SUB_TILE_SIZE,
+                        ((x + width - 1) // SUB_TILE_SIZE) + 1)
+        y_tiles = range(y // SUB_TILE_SIZE,
+                        ((y + height - 1) // SUB_TILE_SIZE) + 1)
+        return set((tx * SUB_TILES_HIGH) + ty for tx in x_tiles for ty in
+                   y_tiles), None
+
+    def tiles_for_packed(pixels_bin):
+        # x is the top 10 bits and y the next 10 of each Pixel.to_bin() record
+        return set(Subscriptions.tile_id(val >> 22, (val >> 12) & 0x3ff) for
+                   val in PixelBatch.from_bin(pixels_bin).vals)
+
+    ###########################################################################
+
+    def subscribe(self, client, tiles=None):
+        """ subscribes client to the given set of tile ids, or to everything
+            if tiles is None. Returns True if this adds area the client was
+            not previously subscribed to. """
+        old = self.client_tiles.get(client, set())
+        self.unsubscribe(client)
+        self.client_tiles[client] = tiles
+        if tiles is None:
+            self.everything.add(client)
+            return old is not None
+        for tile in tiles:
+            self.by_tile.setdefault(tile, set()).add(client)
+        return old is not None and not tiles.issubset(old)
+
+    def unsubscribe(self, client):
+        if client not in self.client_tiles:
+            return
+        tiles = self.client_tiles.pop(client)
+        if tiles is None:
+            self.everything.discard(client)
+            return
+        for tile in tiles:
+            subscribed = self.by_tile[tile]
+            subscribed.discard(client)
+            if len(subscribed) == 0:
+                del self.by_tile[tile]
+
+    def recipients(self, tiles):
+        recipients = set(self.everything)
+        for tile in tiles:
+            if tile in self.by_tile:
+                recipients.update(self.by_tile[tile])
+        return recipients
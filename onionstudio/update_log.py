@@ -0,0 +1,119 @@
+# Copyright (c) 2020 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+import os
+import time
+import struct
+
+# |---u32 length---|---f64 timestamp---|---32 byte payment_hash---|--payload--|
+#
+# The length covers everything after itself, so a reader can skip a record
+# without understanding it and can spot a torn write at the end of the file.
+
+RECORD_LENGTH = struct.Struct(">I")
+RECORD_HEADER = struct.Struct(">d32s")
+
+DEFAULT_SYNC_RECORDS = 64
+DEFAULT_SYNC_MS = 200
+
+
+class UpdateLog(object):
+    """
+    Append-only binary log of settled pixel payloads. The file is kept open
+    and fsync()ed in groups: after sync_records appends or once sync_ms has
+    passed since the last sync, whichever comes first.
+    """
+    def __init__(self, path, sync_records=DEFAULT_SYNC_RECORDS,
+                 sync_ms=DEFAULT_SYNC_MS):
+        self.path = path
+        self.sync_records = sync_records
+        self.sync_ms = sync_ms
+        self.file_ref = open(path, "ab")
+        self.unsynced = 0
+        self.last_sync = time.time()
+
+    def encode_record(timestamp, payment_hash, payload):
+        body = RECORD_HEADER.pack(timestamp, payment_hash) + payload
+        return RECORD_LENGTH.pack(len(body)) + body
+
+    ###########################################################################
+
+    def append(self, payment_hash, payload, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        record = UpdateLog.encode_record(timestamp, payment_hash, payload)
+        self.file_ref.write(record)
+        self.unsynced += 1
+        self.maybe_sync()
+
+    def maybe_sync(self):
+        if self.unsynced == 0:
+            return
+        if self.unsynced >= self.sync_records:
+            self.sync()
+        elif ((time.time() - self.last_sync) * 1000) >= self.sync_ms:
+            self.sync()
+
+    def sync(self):
+        self.file_ref.flush()
+        os.fsync(self.file_ref.fileno())
+        self.unsynced = 0
+        self.last_sync = time.time()
+
+    def offset(self):
+        return self.file_ref.tell()
+
+    def close(self):
+        self.sync()
+        self.file_ref.close()
+
+    ###########################################################################
+
+    def iter_records(path, offset=0):
+        """ yields (end_offset, timestamp, payment_hash, payload) for each
+            whole record from offset onwards. A partial record at the end of
+            the file is treated as the end of the log. """
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while True:
+                length_bin = f.read(RECORD_LENGTH.size)
+                if len(length_bin) < RECORD_LENGTH.size:
+                    return
+                length, = RECORD_LENGTH.unpack(length_bin)
+                if length < RECORD_HEADER.size:
+                    return
+                body = f.read(length)
+                if len(body) < length:
+                    return
+                timestamp, payment_hash = RECORD_HEADER.unpack_from(body)
+                offset += RECORD_LENGTH.size + length
+                yield (offset, timestamp, payment_hash,
+                       body[RECORD_HEADER.size:])
+
+    def convert_text_log(text_path, path):
+        """ writes the records of an old text updates.log, a line of
+            "<timestamp> payload <hex>" per update, to a new binary log at
+            path. The payment hash wasn't logged, so it is left zeroed.
+            Returns the number of records converted and the number of lines
+            that couldn't be read. """
+        converted = 0
+        skipped = 0
+        tmp_path = path + ".tmp"
+        with open(text_path, "r") as text_f, open(tmp_path, "wb") as f:
+            for line in text_f:
+                try:
+                    timestamp, tag, payload_hex = line.split()
+                    assert tag == "payload"
+                    record = UpdateLog.encode_record(float(timestamp),
+                                                     bytes(32),
+                                                     bytes.fromhex(payload_hex))
+                except (ValueError, AssertionError):
+                    skipped += 1
+                    continue
+                f.write(record)
+                converted += 1
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return converted, skipped
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+import os
+import sys
+import time
+import random
+import tempfile
+import argparse
+import contextlib
+
+sys.path.insert(1, os.path.realpath(os.path.pardir))
+
+from onionstudio.pixel import Pixel
+from onionstudio.art_db import ArtDb
+
+
+# Compares the original per-pixel write_rgb()/read_rgb() path against the
+# batch writer and checks that both leave studio.dat byte-identical.
+
+def random_pixels(n):
+    return [Pixel(random.randrange(1024), random.randrange(1024),
+                  "%03x" % random.randrange(0x1000)) for _ in range(n)]
+
+def per_pixel(art_db, pixels):
+    # what record_pixels() used to do, minus the update log
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            for p in pixels:
+                print("writing: %d %d = %s" % (p.x, p.y, p.rgb))
+                art_db.write_rgb(p.x, p.y, p.rgb)
+                assert art_db.read_rgb(p.x, p.y) == p.rgb
+
+def batch(art_db, pixels):
+    art_db.write_pixels(pixels)
+
+def packed(art_db, pixels_bin):
+    art_db.write_packed(pixels_bin)
+
+def timed(name, func, art_db, arg, n_pixels):
+    start = time.time()
+    func(art_db, arg)
+    elapsed = time.time() - start
+    print("%-10s %8d pixels %8.3fs %12.0f pixels/s" % (name, n_pixels, elapsed,
+                                                      n_pixels / elapsed))
+    return art_db.to_bin()
+
+
+parser = argparse.ArgumentParser(prog="bench-art-db.py")
+parser.add_argument("-n", "--n-pixels", type=int, default=200000)
+s = parser.parse_args()
+
+pixels = random_pixels(s.n_pixels)
+pixels_bin = b''.join(p.to_bin() for p in pixels)
+
+with tempfile.TemporaryDirectory() as d:
+    results = []
+    for name, func, arg in [("per-pixel", per_pixel, pixels),
+                            ("batch", batch, pixels),
+                            ("packed", packed, pixels_bin)]:
+        art_db = ArtDb(os.path.join(d, name))
+        results.append(timed(name, func, art_db, arg, len(pixels)))
+        art_db.unmap_art_bin()
+
+assert all(r == results[0] for r in results), "studio.dat output differs"
+print("studio.dat output identical")
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(1, os.path.realpath(os.path.pardir))
+
+from bolt.tlv import Tlv
+from bolt.cursor import Cursor
+from bolt.namespace import Namespace
+
+from onionstudio.pixel import Pixel
+from onionstudio.extension import Extension
+
+
+# Times decoding of onion hop payloads as big as a 1300 byte onion allows,
+# walking the TLV stream by chaining pop() calls (which slice off a new
+# remainder for every TLV) against reading it with a Cursor.
+
+MAX_PAYLOAD = 1300
+
+def many_tlvs_stream():
+    # worst case for per-field copying: as many small TLVs as will fit
+    stream = b''
+    t = 1
+    while True:
+        tlv = Tlv(t, b'\x00').encode()
+        if len(stream) + len(tlv) > MAX_PAYLOAD:
+            return stream
+        stream += tlv
+        t += 2
+
+def pixel_payload():
+    pixels = []
+    while True:
+        p = Pixel(random.randrange(1024), random.randrange(1024),
+                  "%03x" % random.randrange(0x1000))
+        payload = Extension.encode_non_final(1000, 100, "123x45x67",
+                                             pixels + [p])
+        if len(payload) > MAX_PAYLOAD:
+            return Extension.encode_non_final(1000, 100, "123x45x67", pixels)
+        pixels.append(p)
+
+def walk_pop(stream):
+    n = 0
+    while len(stream) > 0:
+        _, stream, err = Tlv.pop(stream)
+        assert err is None
+        n += 1
+    return n
+
+def walk_cursor(stream):
+    n = 0
+    cursor = Cursor(stream)
+    while not cursor.at_end():
+        _, err = Tlv.read(cursor)
+        assert err is None
+        n += 1
+    return n
+
+def timed(name, func, arg, iterations):
+    start = time.process_time()
+    for _ in range(iterations):
+        func(arg)
+    elapsed = time.process_time() - start
+    print("%-28s %8.1fus/payload" % (name, elapsed * 1e6 / iterations))
+
+
+parser = argparse.ArgumentParser(prog="bench-bolt-decode.py")
+parser.add_argument("-i", "--iterations", type=int, default=2000)
+s = parser.parse_args()
+
+stream = many_tlvs_stream()
+payload = pixel_payload()
+assert walk_pop(stream) == walk_cursor(stream)
+
+print("%d byte stream of %d tlvs, %d byte pixel payload" % (
+      len(stream), walk_cursor(stream), len(payload)))
+timed("walk tlvs with pop()", walk_pop, stream, s.iterations)
+timed("walk tlvs with Cursor", walk_cursor, stream, s.iterations)
+timed("Namespace.parse tlvs", lambda b: Namespace.parse(b, {}), stream,
+      s.iterations)
+timed("Extension.parse pixels", Extension.parse, payload, s.iterations)
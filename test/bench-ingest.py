@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(1, os.path.realpath(os.path.pardir))
+
+from bolt.util import h2b
+from bolt.namespace import Namespace
+
+from onionstudio.png import PngToPixels
+from onionstudio.pixel import Pixel
+from onionstudio.extension import Extension, PIXEL_TLV_TYPE
+
+
+# Builds the same payloads mock-tlv-png.py publishes and times the payload
+# handling done per HTLC between htlc_accepted and forward_event, without the
+# ZeroMQ and art db parts.
+
+CHUNK_SIZE = 100
+
+def build_payloads(png_file, x_offset, y_offset):
+    pixels = list(PngToPixels(png_file).iter_at_offset(x_offset, y_offset))
+    payloads = []
+    for i in range(0, len(pixels), CHUNK_SIZE):
+        chunk = pixels[i:i + CHUNK_SIZE]
+        payload = Extension.encode_non_final(1000, 100, "123x45x67", chunk)
+        payloads.append(payload.hex())
+    return payloads
+
+def pixels_per_record(pixels_bin):
+    # the original parse_pixels(), one Pixel object per record popped as hex
+    pixels = []
+    remainder = pixels_bin
+    while len(remainder) > 0:
+        pixel_hex, remainder, err = Namespace.pop_bytes(4, remainder)
+        pixels.append(Pixel.from_bin(h2b(pixel_hex)))
+    return pixels
+
+def parse_original(payload_hex):
+    parsed, err = Extension.parse(h2b(payload_hex))
+    return pixels_per_record(parsed['tlvs'][PIXEL_TLV_TYPE]['pixels_bin'])
+
+def parse_twice(payload_hex):
+    # accept: parse to check the fee and keep only the hex
+    pixels = parse_original(payload_hex)
+    unpaid = {'payload_hex': payload_hex}
+    # settle: decode and parse all over again, then encode the pixels back
+    # for the broadcast
+    pixels = parse_original(unpaid['payload_hex'])
+    return b"".join(p.to_bin() for p in pixels)
+
+def parse_once(payload_hex):
+    payload = h2b(payload_hex)
+    parsed, err = Extension.parse(payload)
+    pixels_bin = parsed['tlvs'][PIXEL_TLV_TYPE]['pixels_bin']
+    unpaid = {'payload': payload, 'pixels_bin': pixels_bin}
+    # settle: just a lookup
+    return unpaid['pixels_bin']
+
+def timed(name, func, payloads):
+    start = time.process_time()
+    for payload_hex in payloads:
+        func(payload_hex)
+    elapsed = time.process_time() - start
+    print("%-12s %6d htlcs %8.3fs cpu %10.1fus/htlc" % (
+          name, len(payloads), elapsed, elapsed * 1e6 / len(payloads)))
+
+
+parser = argparse.ArgumentParser(prog="bench-ingest.py")
+parser.add_argument("x_offset", type=int)
+parser.add_argument("y_offset", type=int)
+parser.add_argument("png_file", type=str)
+s = parser.parse_args()
+
+payloads = build_payloads(s.png_file, s.x_offset, s.y_offset)
+
+timed("parse twice", parse_twice, payloads)
+timed("parse once", parse_once, payloads)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+import os
+import sys
+import time
+import tempfile
+import argparse
+import tracemalloc
+
+from PIL import Image
+
+sys.path.insert(1, os.path.realpath(os.path.pardir))
+
+from onionstudio.png import PngToPixels
+from onionstudio.extension import Extension
+
+
+# Compares holding a drawing as a list of Pixel objects against a PixelBatch:
+# peak memory and time to load the png, then time to cut it into pixel TLVs
+# the size the draw client sends.
+
+CHUNK_SIZE = 300
+
+def full_canvas_png(path):
+    img = Image.effect_noise((1024, 1024), 64).convert("RGB")
+    img.save(path)
+
+def load_list(png_file):
+    return list(PngToPixels(png_file).iter_at_offset(0, 0))
+
+def load_batch(png_file):
+    return PngToPixels(png_file).batch_at_offset(0, 0)
+
+def encode_chunks(pixels):
+    for i in range(0, len(pixels), CHUNK_SIZE):
+        Extension._encode_pixels(pixels[i:i + CHUNK_SIZE])
+
+def bench(name, load, png_file):
+    start = time.process_time()
+    pixels = load(png_file)
+    load_elapsed = time.process_time() - start
+    # tracing slows allocation down a lot, so memory is measured separately
+    tracemalloc.start()
+    load(png_file)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = time.process_time()
+    encode_chunks(pixels)
+    encode_elapsed = time.process_time() - start
+    print("%-6s %8d pixels  load %7.3fs  peak %8.1fMiB  encode %7.3fs" % (
+          name, len(pixels), load_elapsed, peak / 2**20, encode_elapsed))
+    return Extension._encode_pixels(pixels)
+
+
+parser = argparse.ArgumentParser(prog="bench-pixel-batch.py")
+parser.add_argument("png_file", type=str, nargs="?",
+                    help="png to load, a noisy 1024x1024 image if not given")
+s = parser.parse_args()
+
+with tempfile.TemporaryDirectory() as d:
+    png_file = s.png_file
+    if not png_file:
+        png_file = os.path.join(d, "full.png")
+        full_canvas_png(png_file)
+    encoded = [bench("list", load_list, png_file),
+               bench("batch", load_batch, png_file)]
+
+assert encoded[0] == encoded[1], "encoded pixels differ"
+print("encoded pixels identical")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+import os
+import sys
+import time
+import array
+import tempfile
+import argparse
+
+import numpy
+from PIL import Image
+
+sys.path.insert(1, os.path.realpath(os.path.pardir))
+
+from onionstudio.png import PngToPixels
+from onionstudio.pixel import Pixel
+from onionstudio.pixel_batch import PixelBatch
+
+
+# Times converting a png to packed pixels with the original generator of
+# Pixel objects, the per-pixel loop used when numpy isn't installed and the
+# vectorized numpy path, and checks all three give the same pixels in the same
+# order.
+
+def full_canvas_png(path):
+    img = Image.effect_noise((1024, 1024), 64).convert("RGB")
+    # punch some transparency in so the alpha threshold is exercised
+    alpha = Image.effect_noise((1024, 1024), 128)
+    img.putalpha(alpha)
+    img.save(path)
+
+def original_iter_at_offset(img, x_offset, y_offset):
+    # PngToPixels.iter_at_offset() as it was before the packed paths
+    width, height = img.size
+    rgb_raw = img.convert("RGBA")
+    px_data = list(rgb_raw.getdata())
+    pixels = []
+    for h in range(height):
+        for w in range(width):
+            x = w + x_offset
+            if x >= 1024:
+                continue
+            y = h + y_offset
+            if y >= 1024:
+                continue
+            y = h + y_offset
+            idx = (h * width) + w
+            r = px_data[idx][0]
+            g = px_data[idx][1]
+            b = px_data[idx][2]
+            a = px_data[idx][3]
+            # drop mostly transparent pixels
+            if (a < 128):
+                continue
+            rgb = "%02x%02x%02x" % (r, g, b)
+            yield Pixel(x, y, rgb)
+
+def original(pp, x_offset, y_offset):
+    return PixelBatch.from_pixels(
+        list(original_iter_at_offset(pp.img, x_offset, y_offset))).vals
+
+def loop(pp, x_offset, y_offset):
+    return array.array("I", pp._iter_vals(x_offset, y_offset))
+
+def vectorized(pp, x_offset, y_offset):
+    return pp._numpy_vals(numpy, x_offset, y_offset)
+
+def timed(name, func, pp, x_offset, y_offset):
+    start = time.process_time()
+    vals = func(pp, x_offset, y_offset)
+    elapsed = time.process_time() - start
+    print("%-10s %8d pixels %8.3fs" % (name, len(vals), elapsed))
+    return list(vals)
+
+
+parser = argparse.ArgumentParser(prog="bench-png.py")
+parser.add_argument("png_file", type=str, nargs="?",
+                    help="png to convert, a noisy 1024x1024 image if not given")
+parser.add_argument("-x", "--x-offset", type=int, default=0)
+parser.add_argument("-y", "--y-offset", type=int, default=0)
+s = parser.parse_args()
+
+with tempfile.TemporaryDirectory() as d:
+    png_file = s.png_file
+    if not png_file:
+        png_file = os.path.join(d, "full.png")
+        full_canvas_png(png_file)
+    pp = PngToPixels(png_file)
+    results = [timed(name, func, pp, s.x_offset, s.y_offset) for name, func in
+               [("original", original), ("loop", loop),
+                ("numpy", vectorized)]]
+
+assert results[1] == results[0], "loop output differs from the original"
+assert results[2] == results[0], "numpy output differs from the original"
+print("outputs identical")
@@ -49,7 +49,7 @@ s = parser.parse_args()
 
 pp = PngToPixels(s.png_file)
 
-pixels = list(pp.iter_at_offset(s.x_offset, s.y_offset))
+pixels = pp.batch_at_offset(s.x_offset, s.y_offset)
 
 def divide_chunks(l, n):
     # looping till length l
@@ -129,6 +129,28 @@ if __name__ == "__main__":
             assert v == test['value'], "did not get value expected"
     print("passed test cases")
 
+    print("running peek test cases")
+    for test in BIGSIZE_DECODING_TESTS:
+        v, err = BigSize.peek(h2b(test['bytes']))
+        if 'exp_error' in test.keys():
+            assert err is not None, "did not get error as expected"
+        else:
+            assert err is None, "unexpected error"
+            assert v == test['value'], "did not get value expected"
+    print("passed peek test cases")
+
+    print("running underrun message cases")
+    UNDERRUN_MESSAGES = [("", "underrun while peeking a uint8"),
+                         ("fd00", "underrun while peeking a uint16"),
+                         ("fe000100", "underrun while peeking a uint32"),
+                         ("ff00000001000000", "underrun while peeking a uint64")]
+    for stream, msg in UNDERRUN_MESSAGES:
+        _, err = BigSize.peek(h2b(stream))
+        assert err == msg, "unexpected error message: %s" % err
+        _, _, err = BigSize.pop(h2b(stream))
+        assert err == msg, "unexpected error message: %s" % err
+    print("passed underrun message cases")
+
     print("running small")
     TEST_ITERATIONS = 10000
     for _ in range(TEST_ITERATIONS):
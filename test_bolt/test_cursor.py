@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+import os
+import sys
+
+sys.path.insert(1, os.path.realpath(os.path.pardir))
+
+from bolt.util import h2b
+from bolt.cursor import Cursor
+from bolt.bigsize import BigSize
+from bolt.tlv import Tlv
+
+from test_bigsize import BIGSIZE_DECODING_TESTS
+from test_tlv import TLV_VALID_TESTS, TLV_INVALID_TESTS
+
+
+if __name__ == "__main__":
+    print("testing cursor reads")
+    c = Cursor(h2b("0102030405"))
+    assert c.remaining() == 5
+    assert c.peek(2) == h2b("0102")
+    assert c.read(2) == h2b("0102")
+    assert c.read_int(2) == 0x0304
+    assert c.read(2) is None, "read past the end"
+    assert c.remaining() == 1, "failed read moved the cursor"
+    assert c.rest() == h2b("05")
+    assert c.read_int(1) == 5
+    assert c.at_end()
+    print("done testing cursor reads")
+
+    print("testing BigSize.read against BigSize.pop")
+    for test in BIGSIZE_DECODING_TESTS:
+        stream = h2b(test['bytes'])
+        c = Cursor(stream)
+        v, err = BigSize.read(c)
+        pop_v, remainder, pop_err = BigSize.pop(stream)
+        assert (err is None) == (pop_err is None)
+        if err:
+            assert c.offset == 0, "cursor moved on error"
+            continue
+        assert v == pop_v == test['value']
+        assert c.rest() == remainder
+    print("done testing BigSize.read against BigSize.pop")
+
+    print("testing Tlv.read")
+    for test in TLV_VALID_TESTS:
+        stream = h2b(test['stream'])
+        c = Cursor(stream)
+        tlv, err = Tlv.read(c)
+        assert err is None
+        assert tlv.t == test['t']
+        assert tlv.v == h2b(test['v'])
+        assert type(tlv.v) == bytes, "value not copied out of the view"
+        assert c.rest() == h2b(test['r'])
+    for test in TLV_INVALID_TESTS:
+        c = Cursor(h2b(test['stream']))
+        tlv, err = Tlv.read(c)
+        assert err is not None
+        assert c.offset == 0, "cursor moved on error"
+    print("done testing Tlv.read")
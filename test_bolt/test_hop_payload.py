@@ -10,7 +10,9 @@ import json
 sys.path.insert(1, os.path.realpath(os.path.pardir))
 
 from bolt.util import h2b
-from bolt.hop_payload import HopPayload, TlvHopPayload
+from bolt.bigsize import BigSize
+from bolt.tlv import Tlv
+from bolt.hop_payload import HopPayload, TlvHopPayload, LegacyHopPayload
 
 TEST_LEGACY_PAYLOADS = [
     {'stream': "00000067000001000100000000000003e90000007b000000000000000000000000",
@@ -115,3 +117,35 @@ if __name__ == "__main__":
         print(check_err)
         assert check_err is not None, "unexpected success"
     print("done testing bad final hop payloads")
+
+    print("testing encoded lengths")
+    def random_value():
+        return random.choice([0, 1, 0xfc, 0xfd, 0xffff, 0x10000,
+                              random.randrange(2**32),
+                              random.randrange(2**64)])
+    for _ in range(1000):
+        amt = random_value()
+        cltv = random.randrange(2**32)
+        extra = random.choice([0, 1, 252, 253, 1000])
+        payment_secret = "ab" * 32
+        total_msat = random_value()
+        encoded = TlvHopPayload.encode_non_final(amt, cltv, "1x2x3")
+        assert len(encoded) == TlvHopPayload.non_final_len(amt, cltv)
+        encoded = TlvHopPayload.encode_final(amt, cltv)
+        assert len(encoded) == TlvHopPayload.final_len(amt, cltv)
+        encoded = TlvHopPayload.encode_final(amt, cltv, payment_secret,
+                                             total_msat)
+        assert len(encoded) == TlvHopPayload.final_len(amt, cltv,
+                                                       payment_secret,
+                                                       total_msat)
+        # extra_len accounts for tlvs appended to the content, which can
+        # push the length prefix up a size
+        _, content, _ = BigSize.pop(TlvHopPayload.encode_non_final(
+            amt, cltv, "1x2x3"))
+        content += Tlv(65555, bytes(extra)).encode()
+        encoded = BigSize.encode(len(content)) + content
+        assert len(encoded) == TlvHopPayload.non_final_len(
+            amt, cltv, extra_len=Tlv.encoded_len(65555, extra))
+    encoded = LegacyHopPayload.encode("1x2x3", 1000, 100)
+    assert len(encoded) == LegacyHopPayload.encoded_len()
+    print("done testing encoded lengths")
@@ -257,4 +257,19 @@ if __name__ == "__main__":
         assert err is not None, "expected err"
     print("done testing namespace1 decoding falure")
 
+    print("testing fixed width fields")
+    value = bytes(range(32))
+    for pop_func in [Namespace.pop_chain_hash, Namespace.pop_channel_id,
+                     Namespace.pop_sha256]:
+        popped, remainder, err = pop_func(value + h2b("abcd"))
+        assert err is None, "unexpected err"
+        assert popped == value.hex(), "did not pop 32 bytes"
+        assert remainder == h2b("abcd"), "unexpected remainder"
+        popped, remainder, err = pop_func(value)
+        assert err is None, "unexpected err"
+        assert len(remainder) == 0, "unexpected remainder"
+        popped, remainder, err = pop_func(value[:31])
+        assert err is not None, "expected err"
+    print("done testing fixed width fields")
+
     print("finished all tests")
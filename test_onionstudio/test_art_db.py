@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+import os
+import sys
+import random
+import tempfile
+
+sys.path.insert(1, os.path.realpath(os.path.pardir))
+
+from onionstudio.art_db import ArtDb, CHECKPOINT_FORMAT, CHECKPOINT_MAGIC
+from onionstudio.update_log import UpdateLog
+from onionstudio.extension import Extension, PIXEL_TLV_TYPE
+from onionstudio.pixel import Pixel
+
+N_RECORDS = 10
+PIXELS_PER_RECORD = 50
+
+
+def random_payload():
+    pixels = [Pixel(random.randrange(1024), random.randrange(1024),
+                    "%03x" % random.randrange(0x1000)) for _ in
+              range(PIXELS_PER_RECORD)]
+    return Extension.encode_non_final(1000, 100, "123x45x67", pixels)
+
+def record(db, payload):
+    parsed, err = Extension.parse(payload)
+    assert err is None
+    return db.record_pixels(os.urandom(32), payload,
+                            parsed['tlvs'][PIXEL_TLV_TYPE]['pixels_bin'])
+
+def write_file(path, content):
+    with open(path, "wb") as f:
+        f.write(content)
+
+def write_checkpoint(db_dir, offset, seq):
+    write_file(os.path.join(db_dir, "checkpoint.dat"),
+               CHECKPOINT_FORMAT.pack(CHECKPOINT_MAGIC, offset, seq))
+
+
+if __name__ == "__main__":
+    random.seed(0)
+    payloads = [random_payload() for _ in range(N_RECORDS)]
+    half = N_RECORDS // 2
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        print("testing writing records")
+        db = ArtDb(db_dir)
+        for i, payload in enumerate(payloads[:half]):
+            assert record(db, payload) == i + 1
+        canvas_at_half = db.to_bin()
+        for i, payload in enumerate(payloads[half:]):
+            assert record(db, payload) == half + i + 1
+        canvas = db.to_bin()
+        db.unmap_art_bin()
+        log_path = os.path.join(db_dir, "updates.bin")
+        offsets = [r[0] for r in UpdateLog.iter_records(log_path)]
+        assert len(offsets) == N_RECORDS
+        log_size = os.path.getsize(log_path)
+        assert offsets[-1] == log_size
+        print("done testing writing records")
+
+        print("testing recover with a torn record")
+        # a crash before any checkpoint, with none of the pixel writes
+        # reaching studio.dat and the last append cut short
+        write_file(os.path.join(db_dir, "studio.dat"),
+                   b'\xff' * ArtDb.total_bytes())
+        write_checkpoint(db_dir, 0, 0)
+        torn = UpdateLog.encode_record(0.0, bytes(32), random_payload())
+        with open(log_path, "ab") as f:
+            f.write(torn[:len(torn) // 2])
+        db = ArtDb(db_dir)
+        assert db.to_bin() == canvas, "canvas not recovered"
+        assert db.seq == N_RECORDS
+        assert os.path.getsize(log_path) == log_size, "torn record kept"
+        db.unmap_art_bin()
+        print("done testing recover with a torn record")
+
+        print("testing recover from a checkpoint")
+        # a crash after a checkpoint half way through, this time torn inside
+        # the length prefix
+        write_file(os.path.join(db_dir, "studio.dat"), canvas_at_half)
+        write_checkpoint(db_dir, offsets[half - 1], half)
+        with open(log_path, "ab") as f:
+            f.write(torn[:3])
+        db = ArtDb(db_dir)
+        assert db.to_bin() == canvas, "canvas not recovered"
+        assert db.seq == N_RECORDS
+        assert os.path.getsize(log_path) == log_size, "torn record kept"
+        # appends carry on after the truncated tail
+        payload = random_payload()
+        assert record(db, payload) == N_RECORDS + 1
+        canvas = db.to_bin()
+        db.unmap_art_bin()
+        db = ArtDb(db_dir)
+        assert db.to_bin() == canvas
+        assert db.seq == N_RECORDS + 1
+        records = list(UpdateLog.iter_records(log_path))
+        assert len(records) == N_RECORDS + 1
+        assert records[-1][3] == payload
+        db.unmap_art_bin()
+        print("done testing recover from a checkpoint")
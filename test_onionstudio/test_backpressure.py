@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+import os
+import sys
+
+sys.path.insert(1, os.path.realpath(os.path.pardir))
+
+from onionstudio.backpressure import Backpressure
+
+SLOW_SECONDS = 30
+
+
+if __name__ == "__main__":
+    print("testing repeated pauses")
+    b = Backpressure(SLOW_SECONDS)
+    assert not b.is_stuck(now=0)
+    # Twisted pauses the producer again on every write while past the mark
+    for now in range(0, SLOW_SECONDS, 5):
+        b.paused(now=now)
+        assert b.paused_at == 0
+        assert not b.is_stuck(now=now)
+    b.paused(now=SLOW_SECONDS)
+    assert b.is_stuck(now=SLOW_SECONDS), "kept paused but not dropped"
+    b.resumed()
+    assert not b.is_paused()
+    assert not b.is_stuck(now=SLOW_SECONDS * 2)
+    print("done testing repeated pauses")
+
+    print("testing snapshot in flight")
+    b = Backpressure(SLOW_SECONDS)
+    b.paused(now=0)
+    backlog = 100000
+    for now in range(0, SLOW_SECONDS * 3, 5):
+        backlog -= 1000
+        assert not b.is_stuck(snapshot_backlog=backlog, now=now), \
+            "dropped while still reading its snapshot"
+    # stops reading part way through
+    stalled_at = now
+    for now in range(stalled_at, stalled_at + SLOW_SECONDS, 5):
+        assert not b.is_stuck(snapshot_backlog=backlog, now=now)
+    assert b.is_stuck(snapshot_backlog=backlog,
+                      now=stalled_at + SLOW_SECONDS)
+    print("done testing snapshot in flight")
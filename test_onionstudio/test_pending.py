@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020 Jarret Dyrbye
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+import os
+import sys
+import tempfile
+
+sys.path.insert(1, os.path.realpath(os.path.pardir))
+
+from onionstudio.pending import PendingHtlcs, PendingStore
+from onionstudio.pending import PENDING_COMPACT_RECORDS
+from onionstudio.update_log import UpdateLog
+
+EXPIRE_SECONDS = 600
+NOW = 1600000000.0
+
+
+def payment_hash(i):
+    return "%064x" % i
+
+def htlc(i, recv_time=NOW):
+    return {'payload':   ("payload %d" % i).encode("utf8"),
+            'recv_time': recv_time}
+
+def open_pending(path, now=NOW):
+    store = PendingStore(path)
+    pending = PendingHtlcs(EXPIRE_SECONDS, store=store)
+    for h, recv_time, payload in store.load(EXPIRE_SECONDS, now=now):
+        pending.restore(h, {'payload': payload, 'recv_time': recv_time})
+    return pending, store
+
+def crash(store):
+    # what was synced stays, nothing else gets written
+    store.log.sync()
+    store.log.file_ref.close()
+
+def check_entries(pending, indexes):
+    assert len(pending) == len(indexes), "%d pending" % len(pending)
+    for i in indexes:
+        restored = pending.htlcs[payment_hash(i)]
+        assert restored['payload'] == htlc(i)['payload']
+        assert restored['recv_time'] == NOW
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "pending.bin")
+
+        print("testing reload after a crash")
+        pending, store = open_pending(path)
+        assert len(pending) == 0
+        for i in range(10):
+            pending.add(payment_hash(i), htlc(i))
+        # settled, but the pixels weren't synced before the crash so the
+        # removals were never written
+        for i in range(3):
+            pending.pop(payment_hash(i))
+            pending.settled(payment_hash(i))
+        assert store.has_removals()
+        crash(store)
+        pending, store = open_pending(path)
+        check_entries(pending, range(10))
+        # this time the removals were written
+        for i in range(3):
+            pending.pop(payment_hash(i))
+            pending.settled(payment_hash(i))
+        store.write_removals()
+        assert not store.has_removals()
+        crash(store)
+        # and the last append was torn
+        torn = UpdateLog.encode_record(NOW, bytes(32), b"torn")
+        with open(path, "ab") as f:
+            f.write(torn[:len(torn) - 1])
+        pending, store = open_pending(path)
+        check_entries(pending, range(3, 10))
+        # the reload rewrote the file with only the live entries
+        assert store.records == 7
+        assert len(list(UpdateLog.iter_records(path))) == 7
+        store.close()
+        print("done testing reload after a crash")
+
+        print("testing expiry on reload")
+        pending, store = open_pending(path,
+                                      now=NOW + EXPIRE_SECONDS)
+        assert len(pending) == 0
+        assert len(list(UpdateLog.iter_records(path))) == 0
+        store.close()
+        print("done testing expiry on reload")
+
+        print("testing compaction")
+        pending, store = open_pending(path)
+        n = PENDING_COMPACT_RECORDS
+        for i in range(n):
+            pending.add(payment_hash(i), htlc(i))
+        for i in range(n - 10):
+            pending.pop(payment_hash(i))
+            pending.settled(payment_hash(i))
+        # not while removals are still waiting to be written
+        pending.expire(now=NOW)
+        assert store.records == n
+        store.write_removals()
+        assert store.records == 2 * n - 10
+        pending.expire(now=NOW)
+        assert store.records == 10, "not compacted"
+        assert len(list(UpdateLog.iter_records(path))) == 10
+        pending.add(payment_hash(n), htlc(n))
+        crash(store)
+        pending, store = open_pending(path)
+        check_entries(pending, list(range(n - 10, n + 1)))
+        store.close()
+        print("done testing compaction")